@@ -20,29 +20,45 @@
 #  Authors: Patrick Urban
 #
 
+import io
+import os
 import re
+import glob
+import json
+import hashlib
+import binascii
 import sys
 import math
+import mmap
+import zlib
+import struct
 import curses
 import random
 import signal
+import tempfile
+import asyncio
 import argparse
 import datetime
 import threading
+import multiprocessing
+import numpy as np
 
-from time import sleep
-from itertools import chain
+from time import sleep, monotonic, perf_counter, time
+from itertools import chain, count, product
+from collections import deque
+from functools import partial
+from statistics import NormalDist
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
 
 from pyftdi.ftdi import Ftdi
-from pyftdi.jtag import JtagEngine
+from pyftdi.jtag import JtagEngine, JtagError
 from pyftdi.usbtools import UsbTools
 from pyftdi.bits import BitSequence
 
-Boards_e = ['auto', 'pgm', 'evb']
+Boards_e = ['auto', 'pgm', 'evb', 'sim']
 ArgEpilog = 'example usage: python3 serdestool.py'
 
-SER_CLK_PERIOD_NS = 10.0
-
 class bcolors:
     OK    = '\033[92m' # GREEN
     WARN  = '\033[93m' # YELLOW
@@ -65,6 +81,51 @@ def ArgHzParse(value) -> int:
         freq = int(value)
     return freq
 
+def ArgIdxList(value) -> list:
+    try:
+        return [int(idx, 0) for idx in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError
+
+def ArgSweep(value) -> tuple:
+    """Parses FIELD=START:STOP[:STEP] into (field, values), STOP inclusive."""
+    try:
+        name, bounds = value.split('=')
+        bounds = [int(v, 0) for v in bounds.split(':')]
+        start, stop, step = (bounds + [1])[:3] if len(bounds) in (2, 3) else (None, None, None)
+        values = list(range(start, stop + 1, step))
+    except (ValueError, TypeError):
+        raise argparse.ArgumentTypeError(f'invalid sweep "{value}", expected FIELD=START:STOP[:STEP]')
+    field = SerdesTool.regfile.fields.get(name)
+    if field is None or field.mode != 'R/W':
+        raise argparse.ArgumentTypeError(f'{name} is not a writable regfile field')
+    if not values or min(values) < 0 or max(values) > field.max:
+        raise argparse.ArgumentTypeError(f'{name} values must be in [0, {field.max}]')
+    return (name, values)
+
+def PoissonCdf(k, lam) -> float:
+    if lam <= 0:
+        return 1.0
+    return sum(math.exp(i * math.log(lam) - lam - math.lgamma(i + 1)) for i in range(k + 1))
+
+def BerLimits(errors, bits, confidence=0.95) -> tuple:
+    """One-sided Poisson bounds (lower, upper) on the BER at the given confidence."""
+    if bits <= 0:
+        return 0.0, 1.0
+    if errors > 100: # normal approximation
+        z = NormalDist().inv_cdf(confidence)
+        return max(0.0, errors - z * math.sqrt(errors)) / bits, (errors + 1 + z * math.sqrt(errors + 1)) / bits
+    def solve(k, p):
+        # mean lam with PoissonCdf(k, lam) == p, the cdf falls with lam
+        lo, hi = 0.0, k + 10.0 + 10.0 * math.sqrt(k + 1)
+        for _ in range(60):
+            mid = (lo + hi) / 2
+            lo, hi = (mid, hi) if PoissonCdf(k, mid) > p else (lo, mid)
+        return (lo + hi) / 2
+    lower = solve(errors - 1, confidence) if errors > 0 else 0.0
+    upper = solve(errors, 1 - confidence)
+    return lower / bits, upper / bits
+
 def FindAndFormatFtdiAddr(idx=0) -> str:
     ftdiname = {
         0x6010: '2232h',
@@ -75,6 +136,8 @@ def FindAndFormatFtdiAddr(idx=0) -> str:
     vps_lst.append((0x0403, 0x6010)) # evb: FT2232H
     vps_lst.append((0x0403, 0x6014)) # pgm: FT232H
     d = usb.find_all(vps=vps_lst)
+    if args.serial:
+        d = [dev for dev in d if dev[0].sn == args.serial] or d
     if not d:
         raise Exception('Error: No FTDI device found.')
     d = d[idx][0]
@@ -83,6 +146,12 @@ def FindAndFormatFtdiAddr(idx=0) -> str:
     else:
         return f'ftdi://ftdi:{ftdiname[d[1]]}/1'
 
+def FindFtdiSerials() -> list:
+    vps_lst = list()
+    vps_lst.append((0x0403, 0x6010)) # evb: FT2232H
+    vps_lst.append((0x0403, 0x6014)) # pgm: FT232H
+    return [dev.sn for (dev, _) in UsbTools().find_all(vps=vps_lst) if dev.sn]
+
 def ReadCfgFile(filename) -> bytes:
     lst = ['.bit', '.bin']
     binarytype = any(x in filename for x in lst)
@@ -90,22 +159,100 @@ def ReadCfgFile(filename) -> bytes:
 
     if binarytype:
         f = open(filename, mode='rb')
-        cfg_bin = f.read()
+        # map the file instead of reading it, wr_cfg streams straight from it
+        try:
+            cfg_bin = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # empty file
+            pass
+        f.close()
+    else:
+        cfg_bin = ReadCfgText(filename)
+
+    return cfg_bin
+
+def ReadCfgText(filename) -> bytes:
+    """Parse a hex .cfg file, caching the result in a <file>.<sha256>.bin sidecar.
+
+    A sidecar carrying the source mtime is used without hashing the source;
+    otherwise the sidecar matching the source hash is used, and only if there
+    is none the source is parsed again.
+    """
+    mtime = os.stat(filename).st_mtime_ns
+    sidecars = glob.glob(glob.escape(filename) + '.' + '[0-9a-f]' * 16 + '.bin')
+    for sidecar in sidecars:
+        if os.stat(sidecar).st_mtime_ns == mtime:
+            with open(sidecar, mode='rb') as f:
+                return f.read()
+
+    h = hashlib.sha256()
+    with open(filename, mode='rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    sidecar = f'{filename}.{h.hexdigest()[:16]}.bin'
+    if sidecar in sidecars:
+        with open(sidecar, mode='rb') as f:
+            cfg_bin = f.read()
     else:
-        f = open(filename, mode='r')
-        lines = list(f)
-        hexstr = str()
-
-        for i in range(len(lines)):
-            s = lines[i].split('//')
-            if s[0] != '' and s[0] != '\n':
-                hexstr += s[0].strip()
-        # build bytearray
-        cfg_bin = bytes.fromhex(hexstr)
-
-    f.close()
+        cfg_bin = ParseCfgText(filename)
+        try:
+            with open(sidecar + '.tmp', mode='wb') as f:
+                f.write(cfg_bin)
+            os.replace(sidecar + '.tmp', sidecar)
+            for stale in sidecars:
+                os.remove(stale)
+        except OSError:
+            return cfg_bin # read-only location, no cache
+    try:
+        os.utime(sidecar, ns=(mtime, mtime))
+    except OSError:
+        pass
     return cfg_bin
 
+def ParseCfgText(filename, comment=re.compile(rb'//[^\n]*')) -> bytes:
+    # convert blocks of whole lines, carrying a dangling hex digit into the next block
+    cfg_bin = bytearray()
+    carry = b''
+    with open(filename, mode='rb') as f:
+        for lines in iter(lambda: f.readlines(1 << 22), []):
+            digits = carry + b''.join(comment.sub(b'', b''.join(lines)).split())
+            even = len(digits) & ~1
+            cfg_bin += binascii.unhexlify(digits[:even])
+            carry = digits[even:]
+    if carry:
+        raise ValueError(f'Odd number of hex digits in {filename}')
+    return bytes(cfg_bin)
+
+class CfgDatabase:
+    """Digest of the bitstream last loaded, one file per FTDI serial and chain index.
+
+    Boards running in parallel each write their own file, and every write
+    goes through a temporary file of its own, so they never see each other's
+    half-written state.
+    """
+    path = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'serdestool', 'configured')
+
+    def file(self, key) -> str:
+        return os.path.join(self.path, re.sub(r'[^0-9A-Za-z_.-]', '_', key) + '.json')
+
+    def get(self, key):
+        try:
+            with open(self.file(key)) as f:
+                return json.load(f).get('digest')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def set(self, key, digest):
+        try:
+            if digest is None:
+                os.remove(self.file(key))
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.path, suffix='.tmp', delete=False) as f:
+                json.dump({'key': key, 'digest': digest}, f)
+            os.replace(f.name, self.file(key))
+        except OSError:
+            pass
+
 class ColorFormatter:
     pos_cond = ["DONE", "PRESENT", "LOCKED", "IS_ALIGNED", "EN_ADPLL_CTRL", "CONFIG_SEL", "SERDES_ENABLE"]
     neg_cond = ["ERR", "DOWN", "TESTMODE"]
@@ -127,6 +274,99 @@ class ColorFormatter:
             return 4  # Blue for "OVR" values
         return 0  # Default
 
+class CursesFrame:
+    """Keeps the last drawn frame and only rewrites cells that changed."""
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.last = {}
+        self.cells = {}
+        self.max_y, self.max_x = stdscr.getmaxyx()
+
+    def invalidate(self):
+        self.stdscr.clear()
+        self.last = {}
+
+    def begin(self):
+        max_yx = self.stdscr.getmaxyx()
+        if max_yx != (self.max_y, self.max_x):
+            self.max_y, self.max_x = max_yx
+            self.invalidate()
+        self.cells = {}
+
+    def put(self, y, x, text, attr=0):
+        # clip to the screen, curses raises when writing the bottom right cell
+        if y < 0 or y >= self.max_y or x < 0 or x >= self.max_x:
+            return
+        width = self.max_x - x - (1 if y == self.max_y - 1 else 0)
+        if width > 0:
+            self.cells[(y, x)] = (text[:width], attr)
+
+    def commit(self) -> bool:
+        changed = False
+        for (pos, (text, attr)) in self.last.items():
+            if pos not in self.cells:
+                self.stdscr.addstr(*pos, ' ' * len(text))
+                changed = True
+        for (pos, cell) in self.cells.items():
+            old = self.last.get(pos)
+            if old != cell:
+                if old is not None and len(old[0]) > len(cell[0]):
+                    self.stdscr.addstr(*pos, ' ' * len(old[0]))
+                self.stdscr.addstr(*pos, *cell)
+                changed = True
+        self.last = self.cells
+        if changed:
+            self.stdscr.refresh()
+        return changed
+
+def jtag_op(op, bits=lambda self, *a, **kw: 0):
+    """Books calls of a JtagTool method as op with the tool's JtagStats, if any.
+
+    bits(self, *args) gives the bits shifted, None when the call does not
+    touch the cable.
+    """
+    def decorate(fn):
+        def counted(self, *a, **kw):
+            stats = self.stats
+            if stats is None:
+                return fn(self, *a, **kw)
+            n = bits(self, *a, **kw)
+            stats.depth += 1
+            start = perf_counter()
+            try:
+                return fn(self, *a, **kw)
+            finally:
+                dt = perf_counter() - start
+                stats.depth -= 1
+                if not stats.depth:
+                    stats.busy += dt
+                if n is not None:
+                    stats.add(op, n, dt)
+        counted.__name__, counted.__doc__ = fn.__name__, fn.__doc__
+        return counted
+    return decorate
+
+class JtagRead:
+    """Handle of a DR read queued in a JtagTool transaction.
+
+    The bits arrive when the transaction is flushed; result() flushes the
+    pending queue first if that has not happened yet.
+    """
+    __slots__ = ('_tool', '_word')
+
+    def __init__(self, tool, word=None):
+        self._tool = tool
+        self._word = word
+
+    def done(self) -> bool:
+        return self._word is not None
+
+    def result(self) -> BitSequence:
+        if self._word is None:
+            self._tool.flush()
+        return self._word
+
 class JtagTool:
     CMD_JTAG_ID                = '000000' # 0x00
     CMD_JTAG_BYPASS            = '111111' # 0x3F
@@ -139,38 +379,159 @@ class JtagTool:
     CMD_JTAG_STATUS_PLL2       = '011110' # 0x1E
     CMD_JTAG_STATUS_PLL3       = '011111' # 0x1F
 
+    # Upper bound of read data the FTDI may have to hold before a flush
+    MAX_PENDING_READ_BYTES = 256
+
     _chain_len = 0
 
     def __init__(self, engine):
         self._engine = engine
-
+        self._mpsse = not isinstance(engine, SimJtagEngine) # reads can be queued on the FTDI
+        self._txn_depth = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._ir = None
+        self._dirty = False # shifts queued since the last round trip
+        self.stats = None # JtagStats counting this tool
+
+    @contextmanager
+    def transaction(self):
+        """Queue all IR/DR shifts until the outermost transaction ends.
+
+        Reads return JtagRead handles, which resolve at the flush. Write-only
+        sequences go out in a single flush.
+        """
+        self._txn_depth += 1
+        try:
+            yield self
+        finally:
+            self._txn_depth -= 1
+            if self._txn_depth == 0:
+                self.flush()
+
+    @jtag_op('usb', lambda self: 0 if self._dirty else None)
+    def flush(self) -> None:
+        """Send all queued commands and resolve pending reads in order."""
+        pending, self._pending, self._pending_bytes = self._pending, [], 0
+        self._dirty = False
+        if not self._mpsse:
+            self._engine.sync()
+            for (read, word, idx) in pending:
+                read._word = word
+            return
+        ctrl = self._engine.controller
+        ctrl.sync()
+        for (read, length, idx) in pending:
+            read._word = self._trim_dr(ctrl.read_from_buffer(length), idx)
+
+    @jtag_op('usb')
+    def _sync(self) -> None:
+        self._engine.sync()
+        self._dirty = False
+
+    def _queue_read(self, length: int):
+        # shift zeros and leave TDO in the FTDI read buffer until the flush
+        self._engine.controller.write_with_read(BitSequence(0, length=length))
+        self._pending_bytes += (length + 7) // 8
+
+    def result(self, word) -> BitSequence:
+        """The bits of a read_dr result, flushing first if the read is still queued."""
+        return word.result() if isinstance(word, JtagRead) else word
+
+    @jtag_op('ir', lambda self, instruction, idx=0: None if (repr(instruction), idx) == self._ir else self._chain_len * len(instruction))
     def write_ir(self, instruction, idx=0) -> None:
-        byp_before = BitSequence('1'*6*(self._chain_len-idx-1), msb=True)
-        byp_after = BitSequence('1'*6*idx, msb=True)
-        self._engine.write_ir(byp_before+instruction+byp_after)
+        # the instruction register holds its value, skip reloading it
+        key = (repr(instruction), idx)
+        if key == self._ir:
+            return
+        self._engine.write_ir(self._chain({idx: instruction}, BitSequence(self.CMD_JTAG_BYPASS, msb=True)))
+        self._ir = key
+        self._dirty = True
+
+    def write_ir_broadcast(self, instruction, idxs) -> None:
+        """Load instruction into every chain position in idxs, BYPASS elsewhere."""
+        idxs = tuple(sorted(set(idxs)))
+        if len(idxs) == 1:
+            return self.write_ir(instruction, idxs[0])
+        key = (repr(instruction), idxs)
+        if key == self._ir:
+            return
+        self._write_ir_chain(self._chain({idx: instruction for idx in idxs}, BitSequence(self.CMD_JTAG_BYPASS, msb=True)))
+        self._ir = key
+
+    @jtag_op('ir', lambda self, seq: len(seq))
+    def _write_ir_chain(self, seq) -> None:
+        self._engine.write_ir(seq)
+        self._dirty = True
+
+    # Chain order: TDI -> device 0 -> ... -> device N-1 -> TDO. Bits shifted
+    # first end up nearest TDO, so every scan starts with device N-1, and a
+    # read returns the bypass bits of the devices above idx before its data.
+    def _chain(self, payloads, bypass) -> BitSequence:
+        """One scan through the whole chain, payloads[idx] for the selected devices, bypass elsewhere."""
+        seq = BitSequence()
+        for idx in reversed(range(self._chain_len)):
+            seq += payloads.get(idx, bypass)
+        return seq
+
+    @jtag_op('dr', lambda self, payloads: sum(map(len, payloads.values())) + self._chain_len - len(payloads))
+    def write_dr_broadcast(self, payloads) -> None:
+        """Shift one DR carrying payloads[idx] for each selected device."""
+        self._engine.write_dr(self._chain(payloads, BitSequence('0', msb=True))) # 1-bit bypass registers
+        self._dirty = True
+
+    @jtag_op('idle')
+    def go_idle(self) -> None:
+        self._engine.go_idle()
+        self._dirty = True
 
-    def write_dr(self, data, idx=0) -> None:
-        byp_before = BitSequence('0'*(self._chain_len-idx-1), msb=True)
-        if (idx%8) == 0:
-            byp_after = BitSequence('0'*idx, msb=True)
-        else:
-            byp_after = BitSequence('0'*(8-idx), msb=True)
-        self._engine.write_dr(byp_after+data+byp_before)
+    def _dr_bypass(self, idx):
+        """Bypass bits shifted before and after a DR payload for idx."""
+        return BitSequence('0'*(self._chain_len-idx-1), msb=True), BitSequence('0'*idx, msb=True)
 
-    def read_dr(self, length: int, idx=0) -> BitSequence:
-        word = self._engine.read_dr(length+(self._chain_len-idx-1))
-        if idx > 0:
-            return word[(self._chain_len-idx-1):-idx]
-        else:
-            return word[(self._chain_len-idx-1):]
+    def write_dr(self, data, idx=0) -> None:
+        self.write_dr_broadcast({idx: data})
+
+    @jtag_op('dr', lambda self, length, idx=0: length + self._chain_len - idx - 1)
+    def read_dr(self, length: int, idx=0):
+        """Reads the DR of idx, as a JtagRead handle inside a transaction."""
+        length = length+(self._chain_len-idx-1)
+        if self._txn_depth > 0 and not self._mpsse:
+            # the simulator answers at once, the word and the cable time are handed out at flush
+            read = JtagRead(self)
+            self._pending.append((read, self._trim_dr(self._engine.read_dr(length, sync=False), idx), idx))
+            self._dirty = True
+            return read
+        if self._txn_depth > 0:
+            if self._pending_bytes >= self.MAX_PENDING_READ_BYTES:
+                self.flush()
+            self._engine.change_state('shift_dr')
+            self._queue_read(length)
+            self._engine.change_state('update_dr')
+            self._dirty = True
+            read = JtagRead(self)
+            self._pending.append((read, length, idx))
+            return read
+        return self._trim_dr(self._read_now(length), idx)
+
+    @jtag_op('usb')
+    def _read_now(self, length: int) -> BitSequence:
+        # the engine sends everything queued and waits for the bits
+        self._dirty = False
+        return self._engine.read_dr(length)
+
+    def _trim_dr(self, word, idx):
+        # read_dr only shifts as far as the data of idx
+        return word[(self._chain_len-idx-1):]
 
     def get_chunk(self, data, start, length):
         return (data >> start) & ((1 << length) - 1)
 
     # Read the IDCODE right after JTAG reset
     def idcode(self) -> int:
-        idcodes = self._engine.read_dr(128)
-        self._engine.go_idle()
+        self._ir = None # IDCODE is selected after TAP reset
+        idcodes = self._read_now(128)
+        self.go_idle()
         self._chain_len = 0
         for i in range(0, 128, 32):
             chunk_data = self.get_chunk(int(idcodes), i, 32)
@@ -183,39 +544,105 @@ class JtagTool:
     def idcode_seq(self) -> int:
         self.write_ir(BitSequence(self.CMD_JTAG_ID, msb=True))
         status = self.read_dr(32)
-        self._engine.go_idle()
-        return int(status)
+        self.go_idle()
+        return int(self.result(status))
+
+    # Largest payload of a single MPSSE byte shift command
+    CFG_CHUNK = 0x10000
 
     # Configure FPGA using CMD_JTAG_CONFIGURE
+    @jtag_op('cfg', lambda self, cfg_data, idx: 8 * len(cfg_data))
     def wr_cfg(self, cfg_data, idx):
-        a = []
-        b = bytearray(cfg_data)
-
-        for i in range(len(b)):
-            a.append(int(b[i]))
-
-        seq = BitSequence(bytes_=a[:-1], length=len(b)*8, msb=False, msby=True)
+        """Stream the bitstream to the FTDI in CFG_CHUNK blocks.
+
+        cfg_data may be bytes or an mmap; blocks are sent as memoryview slices
+        without building a BitSequence of the whole bitstream. As before, the
+        last byte is shifted as zero.
+        """
+        view = memoryview(cfg_data)
+        total = len(view)
+        if not total:
+            return
+        if not self._mpsse:
+            self.write_ir(BitSequence(self.CMD_JTAG_CONFIGURE, msb=True), idx)
+            self._engine.write_cfg(view, idx)
+            self.go_idle()
+            self._sync()
+            print(f'INFO:  Configured {total} bytes')
+            return
+        ftdi = self._engine.controller.ftdi
+        byp_before, byp_after = self._dr_bypass(idx)
 
         self.write_ir(BitSequence(self.CMD_JTAG_CONFIGURE, msb=True), idx)
-        self.write_dr(seq, idx)
-
-        self._engine.go_idle()
-
-    def wr_serdes_regfile(self, idx, addr, data, mask, wren):
-        self.write_ir(BitSequence(self.CMD_JTAG_WR_SERDES_REGFILE, msb=True), idx)
+        self.flush()
+        self._engine.change_state('shift_dr')
+        if len(byp_before):
+            self._engine.write(byp_before)
+        self._sync()
+
+        start = monotonic()
+        body = view[:-1]
+        for pos in range(0, len(body), self.CFG_CHUNK):
+            block = body[pos:pos+self.CFG_CHUNK]
+            olen = len(block)-1
+            ftdi.write_data(bytes((Ftdi.WRITE_BYTES_NVE_LSB, olen & 0xff, (olen >> 8) & 0xff)))
+            ftdi.write_data(block)
+            elapsed = monotonic() - start
+            print(f'INFO:  Configuring {100*(pos+len(block))/total:5.1f}% {(pos+len(block))/max(elapsed, 1e-6)/1e6:6.2f} MB/s', end='\r')
+
+        # zeroed last byte and trailing bypass bits, the final bit leaves shift_dr
+        self._engine.write(BitSequence(0, length=8)+byp_after, use_last=True)
+        self._engine.change_state('update_dr')
+        self.go_idle()
+        self._sync()
+        elapsed = monotonic() - start
+        print(f'INFO:  Configured {total} bytes in {elapsed:.2f} s ({total/max(elapsed, 1e-6)/1e6:.2f} MB/s)')
+
+    def _regfile_cmd(self, addr, data, mask, wren) -> BitSequence:
         cmd  = BitSequence(value=addr, length=8,  msb=False, msby=True)
         cmd += BitSequence(value=data, length=16, msb=False, msby=True)
         cmd += BitSequence(value=mask, length=16, msb=False, msby=True)
         cmd += BitSequence(value=wren, length=1, msb=False, msby=True)
-        self.write_dr(cmd, idx)
-        self._engine.go_idle()
+        return cmd
+
+    def wr_serdes_regfile(self, idx, addr, data, mask, wren):
+        self.write_ir(BitSequence(self.CMD_JTAG_WR_SERDES_REGFILE, msb=True), idx)
+        self.write_dr(self._regfile_cmd(addr, data, mask, wren), idx)
+        self.go_idle()
+
+    def wr_serdes_regfile_broadcast(self, writes):
+        """Write several devices in one IR and one DR scan.
+
+        writes maps chain index to (addr, data, mask, wren).
+        """
+        if len(writes) == 1:
+            ((idx, cmd),) = writes.items()
+            return self.wr_serdes_regfile(idx, *cmd)
+        self.write_ir_broadcast(BitSequence(self.CMD_JTAG_WR_SERDES_REGFILE, msb=True), writes.keys())
+        self.write_dr_broadcast({idx: self._regfile_cmd(*cmd) for (idx, cmd) in writes.items()})
+        self.go_idle()
 
     def rd_serdes_regfile(self, idx):
         self.write_ir(BitSequence(self.CMD_JTAG_RD_SERDES_REGFILE, msb=True), idx)
         word = self.read_dr(16, idx)
-        self._engine.go_idle()
+        self.go_idle()
         return word
 
+    def rd_serdes_regfile_burst(self, idx, addrs) -> list:
+        """Read several regfile words in one pipelined transaction.
+
+        The address latch for word N+1 is queued directly behind the read of
+        word N, so the cable never waits for a result in between and the whole
+        range is sent in a single flush. Inside an enclosing transaction the
+        words are JtagRead handles.
+        """
+        words = []
+        with self.transaction():
+            for addr in addrs:
+                self.wr_serdes_regfile(idx=idx, addr=addr, data=0, mask=0, wren=0)
+                words.append(self.rd_serdes_regfile(idx))
+        return words if self._txn_depth else [self.result(word) for word in words]
+
     # Read PLLn status
     def rd_status_pll(self, idx=0, pll=0, verbose=0):
         bs = BitSequence()
@@ -231,8 +658,8 @@ class JtagTool:
             raise JtagError("Invalid PLL number: %s" % pll)
             return 0
         self.write_ir(bs, idx)
-        status = self.read_dr(17, idx)
-        self._engine.go_idle()
+        status = self.result(self.read_dr(17, idx))
+        self.go_idle()
 
         pll_status_bin = '{:017b}'.format(int(status))
 
@@ -268,9 +695,806 @@ class JtagTool:
 
         return fine_tune_overflow_flag, fine_tune_underflow_flag, fine_tune_value, state, coarse_tune_value
 
+class SimSerdes:
+    """Software model of one CC_SERDES regfile behind the JTAG interface.
+
+    Fields start at their SerdesTool.regfile defaults. W/C bits clear right
+    after the write that set them and read-only bits ignore writes. The ADPLL
+    locks lock_delay seconds after PLL_EN_ADPLL_CTRL is set, resets finish
+    reset_delay seconds after a write to their register, and the PRBS checker
+    locks when TX_PRBS_SEL and RX_PRBS_SEL agree. Errors accumulate at the
+    line rate times a toy BER, which grows with the distance of the TX driver
+    and RX equalizer settings from EYE_OPTIMUM. With a TX loopback enabled,
+    RX_DATA returns the transmitted 80-bit word: the TX_DATA words once
+    TX_DATA_VALID latches them and TX_DATA_OVR is set, idle characters
+    otherwise.
+    """
+    IDCODE = 0x20000A75
+    IDLE_DATA = 0x1284A1284A1284A128BC # K28.5 then D10.2 repeated, in 10-bit symbols
+    # field: (optimum, span), log10(BER) rises by 6 per span away from the optimum
+    EYE_OPTIMUM = {'TX_AMP': (20, 16), 'TX_SEL_PRE': (2, 12), 'TX_SEL_POST': (6, 12),
+                   'RX_EQA_CKP_LF': (0xA3, 128), 'RX_EQA_CKP_HF': (0xA3, 128)}
+
+    def __init__(self, refclk, ber=1e-12, lock_delay=0.01, reset_delay=0.001):
+        self.regfile = SerdesTool.regfile
+        self.refclk = refclk
+        self.ber = ber
+        self.lock_delay = lock_delay
+        self.reset_delay = reset_delay
+        rf = self.regfile
+        self.writable = [0] * rf.size
+        self.selfclear = [0] * rf.size
+        for field in rf.fields.values():
+            if field.mode in ('R/W', 'W/C'):
+                self.writable[field.addr] |= field.mask
+            if field.mode == 'W/C':
+                self.selfclear[field.addr] |= field.mask
+        self.load()
+
+    def load(self):
+        """Default regfile of a freshly configured SerDes test design."""
+        rf = self.regfile
+        self.words = [0] * rf.size
+        for field in rf.fields.values():
+            self.words[field.addr] |= field.encode(field.val)
+        self.words[0x5C] = 0x0005 # SERDES_ENABLE=1, SERDES_TESTMODE=1
+        self.addr = 0
+        self.now = monotonic()
+        self.lock_at = self.tx_done_at = self.rx_done_at = math.inf
+        self.errors = 0.0
+        self.tx_words = [0] * 5 # TX_DATA auto-increment buffer
+        self.tx_count = 0
+        self.tx_data = self.IDLE_DATA
+
+    def field(self, name) -> int:
+        field = self.regfile.fields[name]
+        return field.decode(self.words[field.addr])
+
+    def set_field(self, name, value):
+        field = self.regfile.fields[name]
+        self.words[field.addr] = (self.words[field.addr] & ~field.mask) | field.encode(value)
+
+    def line_rate(self) -> float:
+        n = SerdesTool.decode_pll_divsel(self.field('PLL_MAIN_DIVSEL'), self.field('PLL_OUT_DIVSEL'))
+        return 2 * self.refclk * n[0] * n[1] * n[2] / n[3] if None not in n else 0.0
+
+    def link_ber(self) -> float:
+        distance = sum(((self.field(name) - opt) / span) ** 2 for (name, (opt, span)) in self.EYE_OPTIMUM.items())
+        return min(0.5, self.ber * 10 ** (6 * distance))
+
+    def update(self):
+        """Advances the status bits and the PRBS error counter to now."""
+        now = monotonic()
+        locked = now >= self.lock_at
+        self.set_field('PLL_LOCKED', locked)
+        self.set_field('PLL_CAP_STATE', 2 if locked else 1 if self.lock_at < math.inf else 0)
+        self.set_field('PLL_BISC_TIMER_DONE', locked)
+        self.set_field('PLL_BISC_CP_VALID', locked)
+        self.set_field('TX_RESET_DONE', locked and now >= self.tx_done_at)
+        self.set_field('RX_RESET_DONE', locked and now >= self.rx_done_at)
+        self.set_field('RX_BYTE_IS_ALIGNED', locked and now >= self.rx_done_at)
+        prbs = self.field('TX_PRBS_SEL')
+        prbs_locked = bool(locked and now >= self.rx_done_at and prbs and prbs == self.field('RX_PRBS_SEL'))
+        if prbs_locked:
+            self.errors += self.link_ber() * self.line_rate() * (now - self.now)
+        self.set_field('RX_PRBS_LOCKED', prbs_locked)
+        self.set_field('RX_PRBS_ERR_CNT', min(int(self.errors), 0x7FFF))
+        loopback = self.field('TX_LOOPBACK_OVR') and (self.field('TX_PMA_LOOPBACK') or self.field('TX_PCS_LOOPBACK'))
+        rx_data = (self.tx_data if self.field('TX_DATA_OVR') else self.IDLE_DATA) if loopback and self.field('RX_BYTE_IS_ALIGNED') else 0
+        for i in range(5):
+            self.words[0x20 + i] = (rx_data >> 16*i) & 0xFFFF
+        self.now = now
+
+    def write(self, addr, data, mask, wren):
+        self.update()
+        self.addr = addr
+        if not wren or addr >= len(self.words):
+            return
+        mask &= self.writable[addr]
+        old = self.words[addr]
+        self.words[addr] = (old & ~mask) | (data & mask)
+        # (re)lock after enabling the ADPLL or changing its dividers
+        if not self.field('PLL_EN_ADPLL_CTRL'):
+            self.lock_at = math.inf
+        elif (addr == 0x50 and not old & 0x0001) or addr == 0x51:
+            self.lock_at = self.now + self.lock_delay
+        if addr == 0x3F:
+            self.tx_done_at = self.now + self.reset_delay
+        elif addr == 0x2B:
+            self.rx_done_at = self.now + self.reset_delay
+        if self.field('RX_PRBS_CNT_RESET'):
+            self.errors = 0.0
+        if self.field('TX_PRBS_FORCE_ERR'):
+            self.errors += 1
+        if addr == 0x42:
+            self.tx_words[self.tx_count % 5] = self.words[addr]
+            self.tx_count += 1
+        elif addr == 0x41 and mask & 0x0E00 and not self.field('TX_DATA_CNT'):
+            self.tx_count = 0
+        if self.field('TX_DATA_VALID'):
+            self.tx_data = sum(word << 16*i for (i, word) in enumerate(self.tx_words))
+        self.words[addr] &= ~self.selfclear[addr]
+        self.update()
+
+    def read(self) -> int:
+        self.update()
+        return self.words[self.addr] if self.addr < len(self.words) else 0
+
+    def status_pll(self) -> int:
+        """17-bit PLL status: flags, fine tune, state and coarse tune."""
+        self.update()
+        return (self.field('PLL_CAP_FT') << 2) | (self.field('PLL_CAP_STATE') << 12)
+
+class SimJtagEngine:
+    """Drop-in for JtagEngine that serves JtagTool from a chain of SimSerdes.
+
+    The chain is TDI -> device 0 -> ... -> device N-1 -> TDO. Each scan is
+    shifted through one register made of the IR, or the DR selected by the
+    IR, of every device: captured before the scan, the LSB of device N-1 out
+    on TDO first, and updated after the scan like a TAP would. A scan laid
+    out for the wrong chain position therefore reaches the wrong device, as
+    it would on hardware. Cable cost is modeled as latency per round trip
+    plus one TCK per bit; sync() sleeps for it only if latency is set, and
+    always adds it to cable_time.
+    """
+    IR_LENGTH = 6
+    IR_CAPTURE = 0b000001
+    DR_LENGTH = {JtagTool.CMD_JTAG_WR_SERDES_REGFILE: 41, JtagTool.CMD_JTAG_RD_SERDES_REGFILE: 16, JtagTool.CMD_JTAG_ID: 32,
+                 JtagTool.CMD_JTAG_STATUS_PLL0: 17, JtagTool.CMD_JTAG_STATUS_PLL1: 17,
+                 JtagTool.CMD_JTAG_STATUS_PLL2: 17, JtagTool.CMD_JTAG_STATUS_PLL3: 17} # others: 1-bit bypass
+
+    def __init__(self, devices=1, refclk=100e6, frequency=20e6, latency=0.0, **model):
+        self.devices = [SimSerdes(refclk, **model) for i in range(devices)]
+        self.frequency = frequency
+        self.latency = latency
+        self.ir = [JtagTool.CMD_JTAG_ID] * devices
+        self.instructions = {int(cmd, 2): cmd for (name, cmd) in vars(JtagTool).items() if name.startswith('CMD_JTAG_')}
+        self.bits = 0
+        self.round_trips = 0
+        self.cable_time = 0.0
+
+    def configure(self, url):
+        pass
+
+    def close(self):
+        pass
+
+    def reset(self):
+        self.ir = [JtagTool.CMD_JTAG_ID] * len(self.devices)
+
+    def go_idle(self):
+        pass
+
+    def change_state(self, statename):
+        pass
+
+    def sync(self):
+        if not self.bits:
+            return
+        t = self.latency + self.bits / self.frequency
+        self.cable_time += t
+        self.round_trips += 1
+        self.bits = 0
+        if self.latency:
+            sleep(t)
+
+    def _shift(self, registers, bits) -> tuple:
+        """Shifts bits through the chain of (length, value) registers, device 0 first.
+
+        Returns the bits seen on TDO and the new register values.
+        """
+        chain = []
+        for (length, value) in reversed(registers):
+            chain += [(value >> i) & 1 for i in range(length)]
+        chain += bits
+        out, chain = chain[:len(bits)], chain[len(bits):]
+        values = []
+        pos = 0
+        for (length, value) in reversed(registers):
+            values.append(sum(b << i for (i, b) in enumerate(chain[pos:pos+length])))
+            pos += length
+        return out, values[::-1]
+
+    def write_ir(self, seq):
+        bits = list(seq.sequence())
+        self.bits += len(bits)
+        out, values = self._shift([(self.IR_LENGTH, self.IR_CAPTURE)] * len(self.devices), bits)
+        self.ir = [self.instructions.get(value, JtagTool.CMD_JTAG_BYPASS) for value in values]
+
+    def _dr_capture(self, d) -> tuple:
+        ir = self.ir[d]
+        if ir == JtagTool.CMD_JTAG_RD_SERDES_REGFILE:
+            value = self.devices[d].read()
+        elif ir == JtagTool.CMD_JTAG_ID:
+            value = SimSerdes.IDCODE
+        elif ir in (JtagTool.CMD_JTAG_STATUS_PLL0, JtagTool.CMD_JTAG_STATUS_PLL1, JtagTool.CMD_JTAG_STATUS_PLL2, JtagTool.CMD_JTAG_STATUS_PLL3):
+            value = self.devices[d].status_pll()
+        else:
+            value = 0
+        return self.DR_LENGTH.get(ir, 1), value
+
+    def _dr_update(self, d, value):
+        if self.ir[d] == JtagTool.CMD_JTAG_WR_SERDES_REGFILE:
+            self.devices[d].write(value & 0xFF, (value >> 8) & 0xFFFF, (value >> 24) & 0xFFFF, value >> 40)
+
+    def _dr_scan(self, bits) -> list:
+        self.bits += len(bits)
+        out, values = self._shift([self._dr_capture(d) for d in range(len(self.devices))], bits)
+        for (d, value) in enumerate(values):
+            self._dr_update(d, value)
+        return out
+
+    def write_dr(self, seq):
+        self._dr_scan(list(seq.sequence()))
+
+    def read_dr(self, length, sync=True) -> BitSequence:
+        bits = self._dr_scan([0] * length)
+        if sync:
+            self.sync()
+        return BitSequence(bits)
+
+    def write_cfg(self, data, idx):
+        """Shifts a bitstream into device idx, which restarts its design."""
+        self.bits += 8 * len(data)
+        self.sync()
+        self.devices[idx].load()
+
+class JtagStats:
+    """Counts the scans, bits and USB round trips of a JtagTool by operation and caller.
+
+    The tool books its own calls, see jtag_op. Latencies go into power-of-two
+    histograms from 1 us up. With callers the ops since the last round trip
+    are put down to the outermost and the innermost SerdesTool method on the
+    stack when that round trip ends, so the stack is walked once per trip.
+    """
+    OPS = ('ir', 'dr', 'idle', 'cfg', 'usb')
+    BUCKETS = 24 # 1 us .. 8 s
+
+    def __init__(self, tool, frequency, callers=True):
+        self.frequency = frequency
+        self.start = perf_counter()
+        self.busy = 0.0 # seconds inside outermost counted calls
+        self.depth = 0
+        self.totals = {op: [0, 0, 0.0] for op in self.OPS} # count, bits, seconds
+        self.callers = {} # (op, caller) -> [count, bits, seconds, histogram]
+        self.codes = {fn.__code__: name for (name, fn) in vars(SerdesTool).items() if hasattr(fn, '__code__')} if callers else None
+        self._ops = [] # (op, bits, seconds) not yet put down to a caller
+        tool.stats = self
+
+    def caller(self) -> str:
+        inner = outer = None
+        f = sys._getframe(2)
+        while f is not None:
+            name = self.codes.get(f.f_code)
+            if name is not None:
+                outer, inner = name, inner or name
+            f = f.f_back
+        if outer is None:
+            return '(no SerdesTool caller)'
+        return inner if outer == inner else f'{outer}/{inner}'
+
+    def add(self, op, bits, dt):
+        total = self.totals[op]
+        total[0] += 1
+        total[1] += bits
+        total[2] += dt
+        if self.codes is None:
+            return
+        self._ops.append((op, bits, dt))
+        if op == 'usb':
+            self.attribute(self.caller())
+
+    def attribute(self, caller):
+        for (op, bits, dt) in self._ops:
+            key = (op, caller)
+            entry = self.callers.get(key)
+            if entry is None:
+                entry = self.callers[key] = [0, 0, 0.0, [0] * self.BUCKETS]
+            entry[0] += 1
+            entry[1] += bits
+            entry[2] += dt
+            entry[3][min(self.BUCKETS - 1, max(0, int(dt * 1e6).bit_length() - 1))] += 1
+        self._ops = []
+
+    def percentile(self, hist, q) -> float:
+        """Upper edge in seconds of the histogram bucket holding quantile q."""
+        rank = q * sum(hist)
+        for (k, n) in enumerate(hist):
+            rank -= n
+            if rank <= 0:
+                break
+        return (1 << (k + 1)) * 1e-6
+
+    def shares(self) -> dict:
+        """Splits the run time into USB latency, TCK, host Python in the scans and the rest."""
+        wall = perf_counter() - self.start
+        usb = self.totals['usb'][2]
+        tck = sum(self.totals[op][1] for op in self.OPS) / max(self.frequency, 1)
+        # TCK cycles only cost wall time while the host waits on a transfer
+        return {'USB latency': max(0.0, usb - tck), 'TCK': min(tck, usb),
+                'scan Python': max(0.0, self.busy - usb), 'outside scans': max(0.0, wall - max(self.busy, usb))}
+
+    def status_line(self) -> str:
+        ir, dr, idle, cfg, usb = (self.totals[op] for op in self.OPS)
+        shares = self.shares()
+        wall = max(sum(shares.values()), 1e-9)
+        return (f"JTAG: {ir[0]} IR {dr[0]} DR {idle[0]} idle {usb[0]} USB, {(ir[1] + dr[1] + cfg[1]) / 1e6:.2f} Mbit | " +
+                ' '.join(f'{name} {t / wall:.0%}' for (name, t) in shares.items()))
+
+    def print_summary(self):
+        if self._ops:
+            self.attribute('(not sent)')
+        print(f'INFO:  JTAG statistics over {perf_counter() - self.start:.1f} s at {self.frequency / 1e6:g} MHz')
+        print(f'{"op":5} {"caller":40} {"count":>8} {"bits":>10} {"time":>9} {"p50":>9} {"p99":>9}')
+        for ((op, caller), (n, bits, t, hist)) in sorted(self.callers.items(), key=lambda item: (self.OPS.index(item[0][0]), -item[1][2])):
+            print(f'{op:5} {caller:40} {n:8} {bits:10} {t:8.3f}s {1e3 * self.percentile(hist, 0.5):7.3f}ms {1e3 * self.percentile(hist, 0.99):7.3f}ms')
+        shares = self.shares()
+        print(f'INFO:  ' + ', '.join(f'{name} {t:.3f} s' for (name, t) in shares.items()))
+        print(f'INFO:  Most time went to {max(shares, key=shares.get)}')
+
+class CableScheduler:
+    """Owns the cable in one asyncio task and serves requests by priority.
+
+    Each request runs to completion on the owner thread, so waits in between
+    requests never block other clients. Only the GUI has several clients, its
+    poller thread and the user; the other modes run on the main thread alone
+    and use the cable directly. The shadow is guarded by SerdesTool.shadow_lock
+    either way.
+    """
+    USER, TESTCASE, POLL, TELEMETRY = range(4)
+
+    def __init__(self):
+        self.loop = None
+        self._queue = None
+        self._order = count()
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=asyncio.run, args=(self._main(),), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._queue.put((-1, -1, None, None)), self.loop).result()
+            self._thread.join()
+            self.loop = None
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._ready.set()
+        while True:
+            (priority, order, fn, future) = await self._queue.get()
+            if fn is None:
+                break
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+        # the stop request jumps the queue, don't leave anyone waiting behind it
+        while not self._queue.empty():
+            (priority, order, fn, future) = self._queue.get_nowait()
+            if future is not None:
+                future.cancel()
+
+    async def submit(self, fn, *args, priority=TESTCASE, **kwargs):
+        future = self.loop.create_future()
+        await self._queue.put((priority, next(self._order), partial(fn, *args, **kwargs), future))
+        return await future
+
+    def call(self, fn, *args, priority=TESTCASE, **kwargs):
+        """Blocking submit for clients running on other threads."""
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(self.submit(fn, *args, priority=priority, **kwargs), self.loop).result()
+
+    def run(self, coro):
+        """Runs a client coroutine on the scheduler loop and waits for it."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+class SerdesField:
+    __slots__ = ('name', 'addr', 'mode', 'hbit', 'lbit', 'width', 'shift', 'mask', 'max', 'val')
+
+    def __init__(self, name, addr, mode, hbit, lbit, val):
+        self.name = name
+        self.addr = addr
+        self.mode = mode
+        self.hbit = hbit
+        self.lbit = lbit
+        self.width = hbit - lbit + 1
+        self.shift = lbit
+        self.max = (1 << self.width) - 1   # largest field value
+        self.mask = self.max << self.shift # field bits within the 16-bit word
+        self.val = val
+
+    def decode(self, word) -> int:
+        return (int(word) & self.mask) >> self.shift
+
+    def encode(self, value) -> int:
+        return (int(value) << self.shift) & self.mask
+
 class SerdesRegfile:
+    # fields that may change without being written by us
+    volatile_modes = ('R', 'R/C', 'W/C')
+
     def __init__(self, initial_fields):
-        self.fields = initial_fields
+        self.fields = {name: SerdesField(name, **data) for (name, data) in initial_fields.items()}
+        # address -> fields located in that word, built once
+        self.by_addr = {}
+        self.volatile = {}
+        for field in self.fields.values():
+            self.by_addr.setdefault(field.addr, []).append(field)
+            if field.mode in self.volatile_modes:
+                self.volatile[field.addr] = self.volatile.get(field.addr, 0) | field.mask
+        self.by_addr = {addr: tuple(fields) for (addr, fields) in self.by_addr.items()}
+        # flat field tables for decoding whole snapshots at once
+        self.order = tuple(self.fields.values())
+        self.index = {field.name: i for (i, field) in enumerate(self.order)}
+        self.addrs = np.array([field.addr for field in self.order], dtype=np.intp)
+        self.shifts = np.array([field.shift for field in self.order], dtype=np.uint16)
+        self.masks = np.array([field.mask for field in self.order], dtype=np.uint16)
+        self.size = max(self.by_addr) + 1
+
+    def decode(self, addr, word):
+        """Returns (field, value) for every field stored in the word at addr."""
+        word = int(word)
+        return [(field, (word & field.mask) >> field.shift) for field in self.by_addr.get(addr, ())]
+
+    def pack(self, values) -> dict:
+        """Merges {name: value} into one {addr: (data, mask)} write per word."""
+        words = {}
+        for (name, value) in values.items():
+            field = self.fields[name]
+            data, mask = words.get(field.addr, (0, 0))
+            words[field.addr] = (data | field.encode(value), mask | field.mask)
+        return words
+
+class SerdesSnapshot:
+    """All regfile words of one SerDes, with every field decoded in one pass."""
+
+    def __init__(self, regfile, words=None):
+        self.regfile = regfile
+        self.words = np.zeros(regfile.size, dtype=np.uint16)
+        if words is not None:
+            self.words[:len(words)] = words
+        self.decode()
+
+    def decode(self):
+        rf = self.regfile
+        self.values = (self.words[rf.addrs] & rf.masks) >> rf.shifts
+        return self
+
+    def freeze(self):
+        self.words.flags.writeable = False
+        self.values.flags.writeable = False
+        return self
+
+    def __getitem__(self, name) -> int:
+        return int(self.values[self.regfile.index[name]])
+
+    def items(self):
+        return zip(self.regfile.order, self.values.tolist())
+
+    def diff(self, other):
+        """Returns (field, old, new) for every field that differs from other."""
+        if other is None:
+            return list(zip(self.regfile.order, [None] * len(self.regfile.order), self.values.tolist()))
+        changed = np.flatnonzero(self.values != other.values)
+        return [(self.regfile.order[i], int(other.values[i]), int(self.values[i])) for i in changed]
+
+class SerdesPoller:
+    """Polls volatile words on every tick and serves configuration words from the shadow.
+
+    The tick (interval, FAST_INTERVAL by default) stretches when the measured
+    cable time per word would make polling take more than duty (DUTY) of the
+    wall clock at the current JTAG frequency.
+    """
+    FAST_INTERVAL = 0.05
+    DUTY = 0.5
+    BITS_PER_WORD = 160 # approx. TCK cycles per regfile read, used until measured
+    CHUNK = 8 # words per cable request, bounds the wait for user writes
+
+    def __init__(self, serdes, idx, addrs, freq, interval=None, duty=None):
+        self.serdes = serdes
+        self.idx = idx
+        self.fast_interval = self.FAST_INTERVAL if interval is None else interval
+        self.duty = self.DUTY if duty is None else duty
+        addrs = list(addrs)
+        # status, counters, data and self-clearing bits change without a write
+        self.fast = [addr for addr in addrs if serdes.regfile.volatile.get(addr)]
+        # configuration words are served from the shadow once known, so they
+        # only hit the cable after an invalidate
+        self.config = [addr for addr in addrs if addr not in self.fast]
+        self.word_time = self.BITS_PER_WORD / max(freq, 1)
+        self.next_fast = 0.0
+
+    def interval(self, base, words) -> float:
+        return max(base, words * self.word_time / self.duty)
+
+    def wait(self) -> float:
+        return max(0.0, self.next_fast - monotonic())
+
+    def poll(self, prev=None) -> 'SerdesSnapshot':
+        now = monotonic()
+        addrs = self.fast + self.config
+        with self.serdes.shadow_lock:
+            hw = sum(not self.serdes.cached(self.idx, addr) for addr in addrs)
+        start = perf_counter()
+        snap = self.serdes.snapshot(self.idx, addrs, base=prev, cached=True, chunk=self.CHUNK, priority=CableScheduler.POLL)
+        if hw:
+            self.word_time = 0.75 * self.word_time + 0.25 * (perf_counter() - start) / hw
+        self.next_fast = now + self.interval(self.fast_interval, len(self.fast))
+        return snap
+
+class ResultStore:
+    """Append-only columnar store of PRBS error counts and the regfile words they were taken with.
+
+    Every column is a numpy memmap in its own file below path, grown GROW rows
+    at a time. index.json holds the committed row count and, per BLOCK rows,
+    the time range and a bit mask of the chain positions present, so queries
+    only touch the blocks they need. Rows not yet in the index are discarded
+    on reopen, so an interrupted run leaves a consistent store.
+    """
+    BLOCK = 4096
+    GROW = 65536
+    COLUMNS = {'time': 'f8', 'device': 'u1', 'errors': 'u4', 'bits': 'f8', 'locked': 'u1', 'words': 'u2'}
+
+    def __init__(self, path, regfile, readonly=False):
+        self.path = path
+        self.regfile = regfile
+        self.readonly = readonly
+        try:
+            with open(os.path.join(path, 'index.json')) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            if readonly:
+                raise
+            os.makedirs(path, exist_ok=True)
+            self.index = {'version': 1, 'width': regfile.size, 'rows': 0, 'blocks': []}
+        self.rows = self.index['rows']
+        self.columns = {}
+        self._map(max(self.rows, 0 if readonly else self.GROW))
+
+    def _map(self, capacity):
+        self.capacity = capacity
+        for (name, dtype) in self.COLUMNS.items():
+            shape = (capacity, self.index['width']) if name == 'words' else (capacity,)
+            filename = os.path.join(self.path, f'{name}.{dtype}')
+            if not self.readonly:
+                with open(filename, 'ab') as f:
+                    f.truncate(max(os.path.getsize(filename), math.prod(shape) * np.dtype(dtype).itemsize))
+            self.columns[name] = np.memmap(filename, dtype=dtype, mode='r' if self.readonly else 'r+', shape=shape) if capacity else np.zeros(shape, dtype)
+
+    def append(self, device, words, errors, bits, locked, t=None):
+        if self.rows == self.capacity:
+            self.flush()
+            self._map(self.capacity + self.GROW)
+        i, t = self.rows, time() if t is None else t
+        cols = self.columns
+        cols['time'][i], cols['device'][i], cols['errors'][i], cols['bits'][i], cols['locked'][i] = t, device, errors, bits, locked
+        cols['words'][i, :len(words)] = words
+        if i % self.BLOCK == 0:
+            self.index['blocks'].append([t, t, 0])
+        block = self.index['blocks'][-1]
+        block[0], block[1], block[2] = min(block[0], t), max(block[1], t), block[2] | (1 << device)
+        self.rows += 1
+        if self.rows % self.BLOCK == 0:
+            self.flush()
+
+    def flush(self):
+        if self.readonly:
+            return
+        for column in self.columns.values():
+            if isinstance(column, np.memmap):
+                column.flush()
+        self.index['rows'] = self.rows
+        filename = os.path.join(self.path, 'index.json')
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(filename + '.tmp', filename)
+
+    def close(self):
+        self.flush()
+        self.columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def blocks(self, device=None, t0=None, t1=None):
+        """Yields the row slices of all blocks that may hold matching rows."""
+        for (n, (tmin, tmax, devices)) in enumerate(self.index['blocks']):
+            if device is not None and not (devices >> device) & 1:
+                continue
+            if (t0 is not None and tmax < t0) or (t1 is not None and tmin > t1):
+                continue
+            yield slice(n * self.BLOCK, min((n + 1) * self.BLOCK, self.rows))
+
+    def ber_by(self, name, device=None, t0=None, t1=None) -> dict:
+        """Returns {field value: (errors, bits)} over all locked matching rows."""
+        field = self.regfile.fields[name]
+        errors = np.zeros(field.max + 1)
+        bits = np.zeros(field.max + 1)
+        cols = self.columns
+        for rows in self.blocks(device, t0, t1):
+            sel = cols['locked'][rows] != 0
+            if device is not None:
+                sel &= cols['device'][rows] == device
+            if t0 is not None or t1 is not None:
+                t = cols['time'][rows]
+                sel &= (t >= (t0 if t0 is not None else -math.inf)) & (t <= (t1 if t1 is not None else math.inf))
+            values = (cols['words'][rows, field.addr][sel] & field.mask) >> field.shift
+            errors += np.bincount(values, weights=cols['errors'][rows][sel], minlength=field.max + 1)
+            bits += np.bincount(values, weights=cols['bits'][rows][sel], minlength=field.max + 1)
+        return {v: (int(errors[v]), float(bits[v])) for v in np.flatnonzero(bits).tolist()}
+
+class TelemetryRecorder:
+    """Streams timestamped regfile snapshots to a zlib compressed log from a background thread.
+
+    Snapshots queue in a ring buffer of RING entries; if the writer falls
+    behind, the oldest are dropped and counted, so memory stays bounded. The
+    log is MAGIC, a json header line, then chunks of up to CHUNK snapshots:
+    '<III' (payload size, snapshots, dropped before this chunk) and a zlib
+    payload of float64 timestamps followed by the uint16 words of each
+    snapshot XORed with the previous one.
+    """
+    MAGIC = b'SDTLOG1\n'
+    RING = 65536
+    CHUNK = 1024
+    FLUSH_INTERVAL = 1.0 # seconds, bounds the data lost on a crash
+
+    def __init__(self, filename, width, header=None):
+        self.filename = filename
+        self.width = width
+        self.header = dict(header or {}, width=width)
+        self.ring = deque(maxlen=self.RING)
+        self.records = self.dropped = self.size = 0
+        self._dropped = 0 # not yet written to a chunk header
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._file = open(self.filename, 'wb')
+        self._file.write(self.MAGIC + json.dumps(self.header).encode() + b'\n')
+        self._thread.start()
+        return self
+
+    def push(self, t, words):
+        if len(self.ring) == self.ring.maxlen:
+            self.dropped += 1
+            self._dropped += 1
+        self.ring.append((t, words))
+        if len(self.ring) >= min(self.CHUNK, self.RING // 2):
+            self._wake.set()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+        self._file.close()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.FLUSH_INTERVAL)
+            self._wake.clear()
+            stop = self._stop
+            while self.ring:
+                self._write([self.ring.popleft() for i in range(min(self.CHUNK, len(self.ring)))])
+            self._file.flush()
+            if stop:
+                return
+
+    def _write(self, records):
+        times = np.array([t for (t, words) in records], dtype='<f8')
+        words = np.array([words for (t, words) in records], dtype='<u2')
+        words[1:] ^= words[:-1].copy()
+        payload = zlib.compress(times.tobytes() + words.tobytes(), 6)
+        dropped, self._dropped = self._dropped, 0
+        self._file.write(struct.pack('<III', len(payload), len(records), dropped) + payload)
+        self.records += len(records)
+        self.size += 12 + len(payload)
+
+def ReadTelemetry(filename):
+    """Yields (timestamp, words) from a TelemetryRecorder log."""
+    with open(filename, 'rb') as f:
+        if f.read(len(TelemetryRecorder.MAGIC)) != TelemetryRecorder.MAGIC:
+            raise ValueError(f'{filename} is not a telemetry log')
+        width = json.loads(f.readline())['width']
+        while (head := f.read(12)):
+            size, n, dropped = struct.unpack('<III', head)
+            data = zlib.decompress(f.read(size))
+            times = np.frombuffer(data, dtype='<f8', count=n)
+            words = np.frombuffer(data, dtype='<u2', offset=8 * n).reshape(n, width)
+            yield from zip(times.tolist(), np.bitwise_xor.accumulate(words, axis=0))
+
+class PllTable:
+    """Every legal ADPLL operating point for one reference clock.
+
+    Points are keyed by their register encoding (PLL_MAIN_DIVSEL,
+    PLL_OUT_DIVSEL) and hold the dividers, the DCO frequency and the bit
+    rate. The table is built on first use; lookup() adds the TX datapath
+    clock for a PLL_FCNTRL and datapath width.
+    """
+    WIDTHS = {0: 20, 1: 40, 2: 80, 3: 80} # TX_DATAPATH_SEL -> datapath width
+    DCO_RANGE = (600e6, 5e9) # DCO frequencies the tool programs, 600 MHz is the default 1/2/3 dividers at 100 MHz
+    MAX_BIT_RATE = 5e9 # fastest CC_SERDES line rate
+    TOLERANCE = 1e-6 # relative deviation pick() accepts
+
+    def __init__(self, refclk, olclkg):
+        self.refclk = refclk
+        self.olclkg = olclkg
+        self._points = None
+        self._rates = None
+
+    def _build(self):
+        points = {}
+        rates = {} # bit rate -> (n1, n2, n3, outdiv), highest DCO first
+        for main_divsel in range(32): # PLL_MAIN_DIVSEL[5] is not used
+            for out_divsel in range(4):
+                n1, n2, n3, outdiv = SerdesTool.decode_pll_divsel(main_divsel, out_divsel)
+                if None in (n1, n2, n3, outdiv):
+                    continue
+                dco = self.refclk * n1 * n2 * n3
+                bit_rate = 2 * dco / outdiv
+                if not self.DCO_RANGE[0] <= dco <= self.DCO_RANGE[1] or bit_rate > self.MAX_BIT_RATE:
+                    continue
+                if bit_rate not in rates or rates[bit_rate][3] < outdiv:
+                    rates[bit_rate] = (n1, n2, n3, outdiv)
+                points[(main_divsel, out_divsel)] = {
+                    'n1': n1, 'n2': n2, 'n3': n3, 'outdiv': outdiv, 'dco': dco, 'bit_rate': bit_rate}
+        self._points, self._rates = points, rates
+
+    @property
+    def points(self):
+        if self._points is None:
+            self._build()
+        return self._points
+
+    @property
+    def rates(self):
+        if self._rates is None:
+            self._build()
+        return self._rates
+
+    def lookup(self, main_divsel, out_divsel, fcntrl, datapath_sel):
+        """Returns the operating point of a register setting, None if it is not legal."""
+        point = self.points.get((main_divsel & 0x1F, out_divsel))
+        if point is None or fcntrl not in self.olclkg:
+            return None
+        width = self.WIDTHS.get(datapath_sel, 80)
+        # the 80-bit datapath divides by two more
+        adddiv = point['outdiv'] * (2 if width == 80 else 1)
+        return dict(point, fcntrl=fcntrl, width=width, datapath_clock=point['dco'] / (self.olclkg[fcntrl] * adddiv))
+
+    def pick(self, bit_rate) -> tuple:
+        """Returns (n1, n2, n3, outdiv, bit rate) for bit_rate.
+
+        Raises ValueError naming the closest legal rate if bit_rate is not
+        within TOLERANCE of one.
+        """
+        best = min(self.rates, key=lambda rate: abs(rate - bit_rate))
+        if abs(best - bit_rate) > self.TOLERANCE * bit_rate:
+            raise ValueError(f'{bit_rate / 1e6:g} Mbit/s is not reachable from a {self.refclk / 1e6:g} MHz reference, closest is {best / 1e6:g} Mbit/s')
+        return self.rates[best] + (best,)
+
+class DerivedCache:
+    """Memoizes values derived from regfile fields until one of their inputs changes."""
+
+    def __init__(self, value):
+        self.value = value
+        self.entries = {}
+
+    def get(self, fn, *names):
+        inputs = tuple(self.value(name) for name in names)
+        entry = self.entries.get(fn)
+        if entry is None or entry[0] != inputs:
+            entry = self.entries[fn] = (inputs, fn(*inputs))
+        return entry[1]
 
 class SerdesTool:
     regfile = SerdesRegfile({
@@ -637,10 +1861,26 @@ class SerdesTool:
     ADPLL_PFDAC_CAL_SIGN = 1
     ADPLL_PFDAC_AUTO_CAL = 1
 
-    # Thread-safe lock for updating values
-    param_lock = threading.Lock()
+    REGFILE_SIZE = 0x5D
 
     def __init__(self, args, jtag, hwinit):
+        self._verify = args.verify
+        self._verify_shadow = args.verifyshadow
+        self._posted = not args.readback
+        self._posted_log = []
+        self._seq_depth = 0
+        self._shadow = {}
+        self.shadow_lock = threading.RLock() # the GUI poller reads the shadow while the scheduler writes it
+        self._updates = 0 # bumped by the GUI poller whenever a field changes
+        self.scheduler = None # set when several clients share the cable
+        self._loop = None # event loop of run() without a scheduler
+        self.published = None # latest immutable snapshot from the GUI poller
+        self.broadcast = tuple(args.broadcast) # chain positions mirroring every write
+        self.wait_times = [] # (field, condition met, seconds) of every wait_for
+        self.store = ResultStore(args.store, self.regfile) if args.store else None
+        self.pll_table = PllTable(args.refclk, self.olclkg)
+        self.stats = None # JtagStats with --stats
+
         if hwinit:
             self._jtag = jtag
             self._board = args.board
@@ -655,23 +1895,65 @@ class SerdesTool:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.store is not None:
+            self.store.close()
+        if self.stats is not None:
+            self.stats.print_summary()
+        if self._loop is not None:
+            self._loop.close()
         self._jtag.close()
 
     def configure(self):
         if self._board == Boards_e[0]: # auto
             self._jtag.configure(FindAndFormatFtdiAddr(0))
         elif self._board == Boards_e[1]: # pgm
-            self._jtag.configure('ftdi://ftdi:232h/1')
+            self._jtag.configure(f'ftdi://ftdi:232h{":" + args.serial if args.serial else ""}/1')
         elif self._board == Boards_e[2]: # evb
-            self._jtag.configure('ftdi://ftdi:2232h/1')
+            self._jtag.configure(f'ftdi://ftdi:2232h{":" + args.serial if args.serial else ""}/1')
+        elif self._board == Boards_e[3]: # sim
+            self._jtag = SimJtagEngine(devices=args.simdevices, refclk=args.refclk, frequency=ArgHzParse(args.freq),
+                                       latency=args.simlatency, ber=args.simber, lock_delay=args.simlockdelay)
         self._jtag.reset()
         self._tool = JtagTool(self._jtag)
+        if args.stats:
+            self.stats = JtagStats(self._tool, ArgHzParse(args.freq))
 
     def rd_id(self):
         self._tool.idcode()
 
-    def wr_cfg(self, bitfile):
+    def wr_cfg(self, bitfile, force=False) -> bool:
+        """Configure the FPGA unless it already runs this bitstream."""
+        digest = hashlib.sha256(bitfile).hexdigest()
+        key = self.cfg_key()
+        db = CfgDatabase()
+        if not force and db.get(key) == digest and self.cfg_running():
+            print(f'INFO:  Bitstream {digest[:16]} already loaded at {key}, skipping configuration '
+                  f'(use --force if the FPGA was programmed by another tool since)')
+            return False
+        db.set(key, None) # don't trust an interrupted configuration
         self._tool.wr_cfg(bitfile, args.idx)
+        self.invalidate(args.idx)
+        if self.cfg_running():
+            db.set(key, digest)
+        else:
+            print(f'ERROR: SerDes not enabled after configuration')
+        return True
+
+    def cfg_key(self) -> str:
+        serial = args.serial or ('sim' if self._board == Boards_e[3] else None)
+        if not serial:
+            try:
+                serial = self._jtag.controller.ftdi.usb_dev.serial_number
+            except Exception:
+                serial = None
+        return f'{serial or "default"}:{args.idx}'
+
+    def cfg_running(self) -> bool:
+        # SERDES_ENABLE is only set while a design with the SerDes is running. Any
+        # SerDes design sets it, so a bitstream loaded by another tool (openFPGALoader,
+        # make jtag) since our last configuration goes unnoticed; --force covers that.
+        word = self.rd_regfile(args.idx, addr=0x5C, mask=0x0001, fresh=True)
+        return word[0] == 1
 
     def gen_module_vlog(self, filename):
         print(f'Generate verilog template: {filename}')
@@ -682,9 +1964,8 @@ class SerdesTool:
             file.write('CC_SERDES #(\n')
             for idx, (param, data) in enumerate(self.regfile.fields.items()):
                 end = '' if idx == len(self.regfile.fields.items())-1 else ','
-                if data['mode'] != 'R':
-                    width = data['hbit']-data['lbit']+1
-                    file.write(f'    .{param}({width}\'h{data['val']:X}){end}\n')
+                if data.mode != 'R':
+                    file.write(f'    .{param}({data.width}\'h{data.val:X}){end}\n')
             file.write(') i_cc_serdes (\n')
             for idx, (port, width) in enumerate(self.ports.items()):
                 end = '' if idx == len(self.ports.items())-1 else ','
@@ -705,8 +1986,8 @@ class SerdesTool:
             file.write('generic (\n')
             for idx, (param, data) in enumerate(self.regfile.fields.items()):
                 end = '' if (idx == len(self.regfile.fields.items())-1) else ';'
-                if data['mode'] != 'R':
-                    hbit = data['hbit']-data['lbit']
+                if data.mode != 'R':
+                    hbit = data.width-1
                     file.write(f'    {param} : bit_vector({hbit} downto 0){end}\n')
             file.write(');\n')
             file.write('port (\n')
@@ -730,9 +2011,8 @@ class SerdesTool:
             file.write('generic map (\n')
             for idx, (param, data) in enumerate(self.regfile.fields.items()):
                 end = '' if (idx == len(self.regfile.fields.items())-1) else ','
-                if data['mode'] != 'R':
-                    width = data['hbit']-data['lbit']+1
-                    file.write(f'    {param} => {width}X"{data['val']:X}"{end}\n')
+                if data.mode != 'R':
+                    file.write(f'    {param} => {data.width}X"{data.val:X}"{end}\n')
             file.write(')\n')
             file.write('port map (\n')
             for idx, (port, width) in enumerate(self.ports.items()):
@@ -758,49 +2038,261 @@ class SerdesTool:
         else:
             print(line)
 
-    def rd_regfile(self, idx, addr) -> int:
+    def snapshot(self, idx, addrs=None, base=None, cached=False, chunk=None, priority=CableScheduler.TESTCASE) -> SerdesSnapshot:
+        """Reads the regfile (or the given addresses) into a snapshot.
+
+        Words not read are taken from base. With cached, known non-volatile
+        words come from the shadow instead of the cable. With chunk, the cable
+        is released between bursts of that many words.
+        """
+        addrs = list(range(self.REGFILE_SIZE) if addrs is None else addrs)
+        snap = SerdesSnapshot(self.regfile, None if base is None else base.words)
+        if cached:
+            with self.shadow_lock:
+                words, known = self.shadow(idx)
+                # a word still queued in another client's sequence is read again below
+                hits = [addr for addr in addrs if self.cached(idx, addr) and not (isinstance(words[addr], JtagRead) and not words[addr].done())]
+                snap.words[hits] = [int(words[addr]) for addr in hits]
+            addrs = [addr for addr in addrs if addr not in hits]
+        for i in range(0, len(addrs), chunk or max(1, len(addrs))):
+            part = addrs[i:i + (chunk or len(addrs))]
+            words = self.submit(self.rd_regfile_burst, idx, part, priority=priority)
+            snap.words[part] = [int(word) for word in words]
+        return snap.decode()
+
+    def submit(self, fn, *args, priority=CableScheduler.TESTCASE, **kwargs):
+        """Runs fn as one cable request, through the scheduler if there is one."""
+        if self.scheduler is None:
+            return fn(*args, **kwargs)
+        return self.scheduler.call(fn, *args, priority=priority, **kwargs)
+
+    async def asubmit(self, fn, *args, priority=CableScheduler.TESTCASE, **kwargs):
+        if self.scheduler is None:
+            return fn(*args, **kwargs)
+        return await self.scheduler.submit(fn, *args, priority=priority, **kwargs)
+
+    def run(self, coro):
+        """Runs a coroutine on the scheduler loop, or on one loop kept for the whole run."""
+        if self.scheduler is not None:
+            return self.scheduler.run(coro)
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    async def wait_for_async(self, name, cond=lambda v: v == 1, timeout=5.0, interval=0.001, max_interval=0.1) -> bool:
+        """Poll a field until cond(value) holds, backing off from 1ms up to max_interval."""
+        field = self.regfile.fields[name]
+        start = monotonic()
+        deadline = start + timeout
+        while True:
+            word = await self.asubmit(self.rd_regfile, args.idx, field.addr, field.mask)
+            ok = bool(cond(field.decode(word)))
+            now = monotonic()
+            if ok or now >= deadline:
+                break
+            await asyncio.sleep(min(interval, deadline - now))
+            interval = min(2 * interval, max_interval)
+        self.wait_times.append((name, ok, now - start))
+        return ok
+
+    def wait_for(self, name, cond=lambda v: v == 1, timeout=5.0) -> bool:
+        return self.run(self.wait_for_async(name, cond, timeout))
+
+    def print_wait_times(self):
+        for name in dict.fromkeys(name for (name, ok, t) in self.wait_times):
+            times = [t for (n, ok, t) in self.wait_times if n == name]
+            fails = sum(not ok for (n, ok, t) in self.wait_times if n == name)
+            print(f'INFO:  Waited for {name:20} {len(times):3}x avg {1e3*sum(times)/len(times):8.1f} ms max {1e3*max(times):8.1f} ms{f" ({fails} timeouts)" if fails else ""}')
+
+    def value(self, name) -> int:
+        """Latest polled value of a field, or its default before the first poll."""
+        snap = self.published
+        return snap[name] if snap is not None else self.regfile.fields[name].val
+
+    def rd_field(self, name, idx=None) -> int:
+        field = self.regfile.fields[name]
+        return field.decode(self.rd_regfile(args.idx if idx is None else idx, field.addr, field.mask))
+
+    def fill_shadow(self, idx):
+        """Reads every regfile word of idx that has bits missing from the shadow."""
+        with self.shadow_lock:
+            words, known = self.shadow(idx)
+            missing = [addr for addr in range(self.REGFILE_SIZE) if known[addr] != 0xFFFF]
+        if missing:
+            self.rd_regfile_burst(idx, missing)
+
+    async def prepare_record(self, devices):
+        # record() stores the whole shadow, so every word has to be known
+        if self.store is not None:
+            for idx in devices:
+                await self.asubmit(self.fill_shadow, idx)
+
+    def record(self, idx, errors, bits, locked):
+        """Appends a PRBS result with the current shadow of idx to the result store.
+
+        Call prepare_record once before a measurement.
+        """
+        if self.store is not None:
+            with self.shadow_lock:
+                words = [self.shadow_word(idx, addr) for addr in range(self.REGFILE_SIZE)]
+            self.store.append(idx, words, errors, bits, locked)
+
+    def cached(self, idx, addr, mask=0xFFFF) -> bool:
+        """True if the masked bits at addr can be served from the shadow."""
+        with self.shadow_lock:
+            words, known = self.shadow(idx)
+            return (mask & ~known[addr]) == 0 and (mask & self.regfile.volatile.get(addr, 0)) == 0
+
+    def shadow(self, idx):
+        """Returns the shadow words and the mask of known bits per address, hold shadow_lock while using them."""
+        with self.shadow_lock:
+            if idx not in self._shadow:
+                self._shadow[idx] = ([0] * self.REGFILE_SIZE, [0] * self.REGFILE_SIZE)
+            return self._shadow[idx]
+
+    def shadow_word(self, idx, addr) -> int:
+        """The shadow word at addr, waiting for it if its read is still queued."""
+        with self.shadow_lock:
+            words, known = self.shadow(idx)
+            return int(self._tool.result(words[addr]))
+
+    def invalidate(self, idx=None, addr=None):
+        with self.shadow_lock:
+            for i in ([idx] if idx is not None else list(self._shadow)):
+                words, known = self.shadow(i)
+                for a in ([addr] if addr is not None else range(self.REGFILE_SIZE)):
+                    known[a] = 0
+
+    def rd_regfile(self, idx, addr, mask=0xFFFF, fresh=False) -> int:
+        """Reads the word at addr, from the shadow if the masked bits are known and non-volatile.
+
+        Checks that confirm what the hardware took pass fresh to always read the device.
+        """
+        with self.shadow_lock:
+            word = BitSequence(value=self.shadow_word(idx, addr), length=16) if not fresh and self.cached(idx, addr, mask) else None
+        if word is not None:
+            if self._verify_shadow:
+                word = self.verify_shadow(idx, addr, word, mask)
+            return word
         self._tool.wr_serdes_regfile(idx=idx, addr=addr, data=0, mask=0, wren=0)
-        return self._tool.rd_serdes_regfile(idx)
+        word = self._tool.result(self._tool.rd_serdes_regfile(idx))
+        with self.shadow_lock:
+            words, known = self.shadow(idx)
+            words[addr], known[addr] = word, 0xFFFF
+        return word
+
+    def rd_regfile_burst(self, idx, addrs, deferred=False) -> list:
+        """Reads addrs in one burst.
+
+        With deferred, reads inside a sequence return JtagRead handles that
+        resolve when the sequence is flushed; otherwise the words are read now.
+        """
+        addrs = list(addrs)
+        result = self._tool.rd_serdes_regfile_burst(idx, addrs)
+        if not deferred:
+            result = [self._tool.result(word) for word in result]
+        with self.shadow_lock:
+            words, known = self.shadow(idx)
+            for (addr, word) in zip(addrs, result):
+                words[addr], known[addr] = word, 0xFFFF
+        return result
+
+    def verify_shadow(self, idx, addr, word, mask=0xFFFF):
+        self._tool.wr_serdes_regfile(idx=idx, addr=addr, data=0, mask=0, wren=0)
+        hw = self._tool.result(self._tool.rd_serdes_regfile(idx))
+        if (int(hw) ^ int(word)) & mask:
+            print(f'ERROR: Shadow mismatch at 0x{addr:02X}: cached=0x{int(word):04X} hw=0x{int(hw):04X} mask=0x{mask:04X}')
+        with self.shadow_lock:
+            words, known = self.shadow(idx)
+            words[addr], known[addr] = hw, 0xFFFF
+        return hw
+
+    def wr_regfile(self, idx, addr, data, mask, verify=True):
+        targets = (idx,) + tuple(i for i in self.broadcast if i != idx)
+        self._tool.wr_serdes_regfile_broadcast({i: (addr, data, mask, 1) for i in targets})
+        if not self._posted:
+            self._tool.rd_serdes_regfile(idx)
+        if self._seq_depth == 0:
+            self._tool.flush()
+        for i in targets:
+            if self._posted and self._verify and verify:
+                self._posted_log.append((i, addr, data, mask))
+            with self.shadow_lock:
+                words, known = self.shadow(i)
+                if isinstance(words[addr], JtagRead) and not words[addr].done():
+                    # don't flush a batch for a queued read, keep only the written bits
+                    words[addr], known[addr] = data & mask, mask
+                else:
+                    words[addr] = (int(words[addr]) & ~mask & known[addr]) | (data & mask)
+                    known[addr] |= mask
+
+    @contextmanager
+    def sequence(self):
+        """Group register accesses into one JTAG transaction.
 
-    def wr_regfile(self, idx, addr, data, mask):
-        self._tool.wr_serdes_regfile(idx=idx, addr=addr, data=data, mask=mask, wren=1)
-        self._tool.rd_serdes_regfile(idx)
+        Posted writes logged in verify mode are read back and checked once
+        the outermost sequence ends.
+        """
+        self._seq_depth += 1
+        try:
+            with self._tool.transaction():
+                yield self
+        finally:
+            self._seq_depth -= 1
+        if self._seq_depth == 0:
+            self.verify_writes()
+
+    def verify_writes(self) -> int:
+        if not self._posted_log:
+            return 0
+        # expected value and mask of every written word, minus self-changing bits
+        expected = {}
+        for (idx, addr, data, mask) in self._posted_log:
+            value, known = expected.get((idx, addr), (0, 0))
+            expected[(idx, addr)] = ((value & ~mask) | (data & mask), known | mask)
+        self._posted_log = []
+        errors = 0
+        for idx in sorted(set(key[0] for key in expected)):
+            addrs = sorted(addr for (i, addr) in expected if i == idx)
+            for (addr, word) in zip(addrs, self.rd_regfile_burst(idx, addrs)):
+                value, mask = expected[(idx, addr)]
+                mask &= ~self.regfile.volatile.get(addr, 0)
+                if (int(word) ^ value) & mask:
+                    print(f'ERROR: Write verify failed at 0x{addr:02X}: expected=0x{value & mask:04X} read=0x{int(word) & mask:04X} mask=0x{mask:04X}')
+                    errors += 1
+        return errors
+
+    def print_regfile_word(self, addr, word):
+        for (field, v) in self.regfile.decode(addr, word):
+            line = f'{field.name:24} {v:4X}\'h {v:6}\'d'
+            self.fprint(field.name, v, line)
 
     def rd_regfile_rx(self, verbose=0):
-        for addr in range(0x00, 0x30):
-            word = self.rd_regfile(args.idx, addr)
+        addrs = range(0x00, 0x30)
+        for (addr, word) in zip(addrs, self.rd_regfile_burst(args.idx, addrs)):
             if verbose == 1:
                 print(f'{addr:02X}: 0x{int(word):04X}')
             elif verbose == 2:
-                filtered_entries = {key: value for key, value in self.regfile.fields.items() if value['addr'] == addr}
-                for (key, value) in filtered_entries.items():
-                    v = word[value['lbit']:value['hbit']+1]
-                    line = f'{key:24} {int(v):4X}\'h {int(v):6}\'d'
-                    self.fprint(key, v, line)
+                self.print_regfile_word(addr, word)
 
     def rd_regfile_rx_data(self):
         rxd_80bit = BitSequence()
-        for addr in range(0x20, 0x25):
-            rxd_80bit += self.rd_regfile(args.idx, addr)
+        for word in self.rd_regfile_burst(args.idx, range(0x20, 0x25)):
+            rxd_80bit += word
         rxd_64bit = rxd_80bit[0:7+1] + rxd_80bit[10:17+1] + rxd_80bit[20:27+1] + rxd_80bit[30:37+1] + rxd_80bit[40:47+1] + rxd_80bit[50:57+1] + rxd_80bit[60:67+1] + rxd_80bit[70:77+1]
         return rxd_64bit, rxd_80bit
 
     def print_regfile_rx_data(self, verbose=0):
         rx_data_80bit = 0
         word_idx = 0
-        for addr in range(0x20, 0x25):
-            word = self.rd_regfile(args.idx, addr)
+        addrs = range(0x20, 0x25)
+        for (addr, word) in zip(addrs, self.rd_regfile_burst(args.idx, addrs)):
             if verbose == 1:
                 print(f'{addr:02X}: 0x{int(word):04X}')
-            rx_fields = {
-                key: field for key, field in self.regfile.fields.items()
-                if field['addr'] == addr and key.startswith('RX_DATA[')
-            }
-            for field_name, field_info in rx_fields.items():
-                # Extract the relevant bits from the word
-                bit_slice = word[field_info['lbit']:field_info['hbit'] + 1]
-                rx_data_80bit |= int(bit_slice) << (16 * word_idx)
-                word_idx += 1
+            for (field, v) in self.regfile.decode(addr, word):
+                if field.name.startswith('RX_DATA['):
+                    rx_data_80bit |= v << (16 * word_idx)
+                    word_idx += 1
 
         if verbose == 2:
             print(f'{"RX_DATA[79:0]":24} {rx_data_80bit:020X}\'h')
@@ -819,37 +2311,30 @@ class SerdesTool:
         return rx_data_64bit, rx_data_80bit
 
     def wr_regfile_tx_data(self, data):
-        self.wr_regfile(idx=args.idx, addr=0x41, data=0x1000, mask=0x1F00) # TX_DATA_OVR=1, TX_DATA_CNT=0, TX_DATA_VALID=0
-        for i in range(5):
-            self.wr_regfile(idx=args.idx, addr=0x42, data=(data >> 16*i) & 0xFFFF, mask=0xFFFF) # auto inc
-        self.wr_regfile(idx=args.idx, addr=0x41, data=0x1B00, mask=0x1F00) # TX_DATA_OVR=1, TX_DATA_CNT=5, TX_DATA_VALID=1
+        with self.sequence():
+            self.wr_regfile(idx=args.idx, addr=0x41, data=0x1000, mask=0x1F00, verify=False) # TX_DATA_OVR=1, TX_DATA_CNT=0, TX_DATA_VALID=0
+            for i in range(5):
+                self.wr_regfile(idx=args.idx, addr=0x42, data=(data >> 16*i) & 0xFFFF, mask=0xFFFF, verify=False) # auto inc
+            self.wr_regfile(idx=args.idx, addr=0x41, data=0x1B00, mask=0x1F00, verify=False) # TX_DATA_OVR=1, TX_DATA_CNT=5, TX_DATA_VALID=1
 
     def rd_regfile_tx(self, verbose=0):
-        for addr in range(0x30, 0x43): # 0x43..0x4F unused
-            word = self.rd_regfile(args.idx, addr)
+        addrs = range(0x30, 0x43) # 0x43..0x4F unused
+        for (addr, word) in zip(addrs, self.rd_regfile_burst(args.idx, addrs)):
             if verbose == 1:
                 print(f'{addr:02X}: 0x{int(word):04X}')
             elif verbose == 2:
-                filtered_entries = {key: value for key, value in self.regfile.fields.items() if value['addr'] == addr}
-                for (key, value) in filtered_entries.items():
-                    v = word[value['lbit']:value['hbit']+1]
-                    line = f'{key:24} {int(v):4X}\'h {int(v):6}\'d'
-                    self.fprint(key, v, line)
+                self.print_regfile_word(addr, word)
 
     def rd_regfile_pll(self, verbose=0):
-        for addr in range(0x50, 0x5D):
-            word = self.rd_regfile(args.idx, addr)
+        addrs = range(0x50, 0x5D)
+        for (addr, word) in zip(addrs, self.rd_regfile_burst(args.idx, addrs)):
             if verbose == 1:
                 print(f'{addr:02X}: 0x{int(word):04X}')
             elif verbose == 2:
-                filtered_entries = {key: value for key, value in self.regfile.fields.items() if value['addr'] == addr}
-                for (key, value) in filtered_entries.items():
-                    v = word[value['lbit']:value['hbit']+1]
-                    line = f'{key:24} {int(v):4X}\'h {int(v):6}\'d'
-                    self.fprint(key, v, line)
+                self.print_regfile_word(addr, word)
 
     def rd_regfile_pll_div_settings(self):
-        word = self.rd_regfile(args.idx, addr=0x51)
+        word = self.rd_regfile(args.idx, addr=0x51, mask=0x3FFF)
         FCNTRL = word[0:5+1]
         MAIN_DIVSEL = word[6:11+1]
         OUT_DIVSEL = word[12:13+1]
@@ -858,16 +2343,59 @@ class SerdesTool:
         n3 = MAIN_DIVSEL[3:4+1]
         return n1, n2, n3, OUT_DIVSEL
 
+    @staticmethod
+    def decode_pll_divsel(main_divsel, out_divsel) -> tuple:
+        """Returns (N1, N2, N3, OUTDIV), None for invalid encodings."""
+        n3 = {0b00: 3, 0b10: 4, 0b11: 5}.get((main_divsel >> 3) & 0b11, None)
+        n1 = {0b0: 1, 0b1: 2}.get((main_divsel >> 2) & 0b1, None)
+        n2 = {0b00: 3, 0b01: 2, 0b10: 4, 0b11: 5}.get(main_divsel & 0b11, None)
+        outdiv = {0b00: 1, 0b01: 2, 0b11: 4}.get(out_divsel, None)
+        return n1, n2, n3, outdiv
+
+    TX_VOLTAGE_FIELDS = ("TX_TAIL_CASCODE", "TX_AMP", "TX_BRANCH_EN_PRE", "TX_BRANCH_EN_MAIN", "TX_BRANCH_EN_POST", "TX_SEL_PRE", "TX_SEL_POST")
+    RX_DATA_FIELDS = ("RX_DATA[79:64]", "RX_DATA[63:48]", "RX_DATA[47:32]", "RX_DATA[31:16]", "RX_DATA[15:0]")
+
+    @staticmethod
+    def tx_voltages(value) -> tuple:
+        """Returns (unit current in uA, Va, Vb, Vc, Vd) of the TX driver into 50 Ohm.
+
+        value maps a field name to its value, e.g. SerdesTool.value.
+        """
+        txuc = (value("TX_TAIL_CASCODE") + 10) * (value("TX_AMP") + 1) * 9.375 # uA
+
+        branch_pre  = value("TX_BRANCH_EN_PRE")
+        brach_main  = value("TX_BRANCH_EN_MAIN")
+        branch_post = value("TX_BRANCH_EN_POST")
+
+        total_number_of_branches = branch_pre + brach_main + branch_post
+        pre_cursor  = value("TX_SEL_PRE")
+        post_cursor = value("TX_SEL_POST")
+        main_cursor = total_number_of_branches - pre_cursor - post_cursor
+
+        vd = total_number_of_branches * txuc * 0.000001 * 50 # Ohm
+        vb = (main_cursor - pre_cursor - post_cursor) * txuc * 0.000001 * 50 # Ohm
+        vc = (main_cursor + pre_cursor - post_cursor) * txuc * 0.000001 * 50 # Ohm
+        va = (main_cursor - pre_cursor + post_cursor) * txuc * 0.000001 * 50 # Ohm
+        return txuc, va, vb, vc, vd
+
+    def line_rate(self):
+        """Serial line rate in bit/s from the current ADPLL dividers."""
+        word = int(self.rd_regfile(args.idx, addr=0x51, mask=0x3FC0))
+        n = self.decode_pll_divsel((word >> 6) & 0x3F, (word >> 12) & 0x3)
+        return 2 * args.refclk * n[0] * n[1] * n[2] / n[3] if None not in n else None
+
     def rd_regfile_pll_status(self):
-        return self.rd_regfile(args.idx, addr=0x55) + self.rd_regfile(args.idx, addr=0x56)
+        status, sync = self.rd_regfile_burst(args.idx, [0x55, 0x56])
+        return status + sync
 
     def rd_regfile_pll_bisc_status(self):
-        return self.rd_regfile(args.idx, addr=0x5A) + self.rd_regfile(args.idx, addr=0x5B)
+        status, co = self.rd_regfile_burst(args.idx, [0x5A, 0x5B])
+        return status + co
 
     def reset_serdes_tx(self):
         print('INFO:  Resetting SerDes TX')
 
-        word = self.rd_regfile(args.idx, addr=0x5C)
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
         if (word[0] != 1 or word[2] != 1):
             print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
             return
@@ -875,44 +2403,38 @@ class SerdesTool:
         # TX reset
         self.wr_regfile(idx=args.idx, addr=0x3F, data=0xC000, mask=0xC000) # TX_RESET_OVR=1, TX_RESET=1
         self.wr_regfile(idx=args.idx, addr=0x3F, data=0x0000, mask=0xC000) # TX_RESET_OVR=0, TX_RESET=0
-        word = self.rd_regfile(args.idx, addr=0x41)
-        timeout = 5
-        while timeout > 0:
-            if (int(word[14]) != 1): # TX_RESET_DONE
-                timeout = timeout - 1
-                if timeout == 0:
-                    print(f'ERROR: TX_RESET_DONE timeout')
-            else:
-                break
+        if not self.wait_for('TX_RESET_DONE', timeout=1):
+            print(f'ERROR: TX_RESET_DONE timeout')
 
     def set_serdes_datapath(self, mode=80):
-        if mode == 0 or mode == 20:
-            self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0000, mask=0x000C) # RX_DATAPATH_SEL=0
-            self.wr_regfile(idx=args.idx, addr=0x40, data=0x0000, mask=0x0018) # TX_DATAPATH_SEL=0 (16/20)
-        elif mode == 1 or mode == 40:
-            datapath_sel = 1
-            self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0001, mask=0x000C) # RX_DATAPATH_SEL=1
-            self.wr_regfile(idx=args.idx, addr=0x40, data=0x0008, mask=0x0018) # TX_DATAPATH_SEL=1 (32/40)
-        elif mode == 2 or mode == 3 or mode == 80:
-            datapath_sel = 3
-            self.wr_regfile(idx=args.idx, addr=0x2A, data=0x000C, mask=0x000C) # RX_DATAPATH_SEL=3
-            self.wr_regfile(idx=args.idx, addr=0x40, data=0x0018, mask=0x0018) # TX_DATAPATH_SEL=3 (64/80)
-        else:
-            print(f'ERROR: Invalid datapath configruation {mode}')
+        with self.sequence():
+            if mode == 0 or mode == 20:
+                self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0000, mask=0x000C) # RX_DATAPATH_SEL=0
+                self.wr_regfile(idx=args.idx, addr=0x40, data=0x0000, mask=0x0018) # TX_DATAPATH_SEL=0 (16/20)
+            elif mode == 1 or mode == 40:
+                datapath_sel = 1
+                self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0001, mask=0x000C) # RX_DATAPATH_SEL=1
+                self.wr_regfile(idx=args.idx, addr=0x40, data=0x0008, mask=0x0018) # TX_DATAPATH_SEL=1 (32/40)
+            elif mode == 2 or mode == 3 or mode == 80:
+                datapath_sel = 3
+                self.wr_regfile(idx=args.idx, addr=0x2A, data=0x000C, mask=0x000C) # RX_DATAPATH_SEL=3
+                self.wr_regfile(idx=args.idx, addr=0x40, data=0x0018, mask=0x0018) # TX_DATAPATH_SEL=3 (64/80)
+            else:
+                print(f'ERROR: Invalid datapath configruation {mode}')
 
     def check_serdes_datapath(self, mode):
         check = 3 if mode == 80 else 1 if mode == 40 else 0 if mode == 20 else mode
-        word = self.rd_regfile(args.idx, addr=0x2A)
+        word = self.rd_regfile(args.idx, addr=0x2A, mask=0x000C, fresh=True)
         if (int(word[2:3+1]) != check):
             print(f'ERROR: RX_DATAPATH_SEL != {check} ({int(word[2:3+1]):2X})')
-        word = self.rd_regfile(args.idx, addr=0x40)
+        word = self.rd_regfile(args.idx, addr=0x40, mask=0x0018, fresh=True)
         if (int(word[3:4+1]) != check):
             print(f'ERROR: TX_DATAPATH_SEL != {check} ({int(word[3:4+1]):2X})')
 
     def reset_serdes_rx(self):
         print('INFO:  Resetting SerDes RX')
 
-        word = self.rd_regfile(args.idx, addr=0x5C)
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
         if (word[0] != 1 or word[2] != 1):
             print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
             return
@@ -920,23 +2442,24 @@ class SerdesTool:
         # RX reset
         self.wr_regfile(idx=args.idx, addr=0x2B, data=0x0003, mask=0x0003) # RX_RESET_OVR=1, RX_RESET=1
         self.wr_regfile(idx=args.idx, addr=0x3F, data=0x0000, mask=0x0003) # RX_RESET_OVR=0, RX_RESET=0
-        word = self.rd_regfile(args.idx, addr=0x2C)
-        timeout = 5
-        while timeout > 0:
-            if (int(word[10]) != 1): # RX_RESET_DONE
-                timeout = timeout - 1
-                if timeout == 0:
-                    print(f'ERROR: RX_RESET_DONE timeout')
-            else:
-                break
+        if not self.wait_for('RX_RESET_DONE', timeout=1):
+            print(f'ERROR: RX_RESET_DONE timeout')
 
     def reset_serdes_trx(self):
         self.reset_serdes_tx()
         self.reset_serdes_rx()
 
-    def start_serdes_pll(self, n1=1, n2=2, n3=3, outdiv=4, calib=False):
+    def start_serdes_pll(self, n1=1, n2=2, n3=3, outdiv=4, calib=False, rate=None):
         print('INFO:  Configuring SerDes ADPLL')
 
+        # rate in Mbit/s overrides the dividers
+        if rate is not None:
+            try:
+                n1, n2, n3, outdiv, bit_rate = self.pll_table.pick(rate * 1e6)
+            except ValueError as e:
+                print(f'ERROR: {e}')
+                return
+
         if (n1 < 1 or n1 > 2):
             print(f'ERROR: Main divider N1 is out of range 1..2')
             return
@@ -950,73 +2473,67 @@ class SerdesTool:
             print(f'ERROR: Output divider N3 is limited to 1, 2 or 4')
             return
 
-        dco = 1000.0 / SER_CLK_PERIOD_NS * n1 * n2 * n3
+        dco = args.refclk / 1e6 * n1 * n2 * n3
         freq = dco / outdiv
         print(f'INFO:  SerDes ADPLL frequency / data rate is {freq} MHz / {freq*2} Mbit/s')
 
-        status = self.rd_regfile_pll_status()
-        if (status[0] == 1):
-            print('INFO:  Disabling SerDes ADPLL')
-            self.wr_regfile(idx=args.idx, addr=0x50, data=0x0000, mask=0x0001)
-
-        if outdiv == 1:
-            pll_div = 0x0000
-        elif outdiv == 2:
-            pll_div = 0x1000
-        else:
-            pll_div = 0x3000
-        if n2 == 5:
-            pll_div = (pll_div & ~(0b11 << 6)) | (0b11 << 6)
-        elif n2 == 4:
-            pll_div = (pll_div & ~(0b11 << 6)) | (0b10 << 6)
-        elif n2 == 2:
-            pll_div = (pll_div & ~(0b11 << 6)) | (0b01 << 6)
-        if n1 == 2:
-            pll_div |= (1 << 8)
-        if n3 == 5:
-            pll_div = (pll_div & ~(0b11 << 9)) | (0b11 << 9)
-        elif n3 == 4:
-            pll_div = (pll_div & ~(0b11 << 9)) | (0b10 << 9)
-
-        print('INFO:  Writing SerDes ADPLL divider settings')
-        self.wr_regfile(idx=args.idx, addr=0x51, data=pll_div, mask=0x3FC0)
-
-        if (calib):
-            print('INFO:  Stopping SerDes ADPLL self-calibration')
-            self.wr_regfile(idx=args.idx, addr=0x57, data=0x0004, mask=0x0007)
-            self.wr_regfile(idx=args.idx, addr=0x57, data=
-                ((self.ADPLL_PFDAC_TIMER    & 0x000F) <<  3) |
-                ((self.ADPLL_PFDAC_COR_DLY  & 0x0007) << 10) |
-                ((self.ADPLL_PFDAC_CAL_SIGN & 0x0001) << 13) |
-                ((self.ADPLL_PFDAC_AUTO_CAL & 0x0001) << 14),
-                mask=0xFFF8)
-            self.wr_regfile(idx=args.idx, addr=0x58, data=
-                ((self.ADPLL_PFDAC_COR_DLY  & 0x001F) << 0) |
-                ((self.ADPLL_PFDAC_CAL_SIGN & 0x001F) << 5) |
-                ((self.ADPLL_PFDAC_AUTO_CAL & 0x001F) << 10),
-                mask=0xFFFF)
-
-        print('INFO:  Starting SerDes ADPLL')
-        self.wr_regfile(idx=args.idx, addr=0x50, data=0x0002, mask=0x0007)
-        self.wr_regfile(idx=args.idx, addr=0x50, data=0x0003, mask=0x0003)
-
-        if (calib):
-            print('INFO:  Starting SerDes ADPLL self-calibration')
-            self.wr_regfile(idx=args.idx, addr=0x57, data=0x0004, mask=0x0007)
-            self.wr_regfile(idx=args.idx, addr=0x57, data=0x0005, mask=0x0007) # BISC mode B, enable
-
-        timeout = 5
-        while timeout > 0:
-            sleep(0.5)
+        with self.sequence():
             status = self.rd_regfile_pll_status()
-            if (status[0] == 0):
-                timeout = timeout - 1
-                print(f'INFO:  LCK: {int(status[0]):1d} FTO: {int(status[1]):1d} FTU: {int(status[2]):1d} FT: {int(status[3:12+1]):4d} SY: {int(status[16:23+1]):3d} ST: {int(status[13:14+1]):1d}')
-                if timeout == 0:
-                    print(f'ERROR: SerDes ADPLL lock timeout')
+            if (status[0] == 1):
+                print('INFO:  Disabling SerDes ADPLL')
+                self.wr_regfile(idx=args.idx, addr=0x50, data=0x0000, mask=0x0001)
+
+            if outdiv == 1:
+                pll_div = 0x0000
+            elif outdiv == 2:
+                pll_div = 0x1000
             else:
-                print(f'INFO:  SerDes ADPLL locked')
-                break
+                pll_div = 0x3000
+            if n2 == 5:
+                pll_div = (pll_div & ~(0b11 << 6)) | (0b11 << 6)
+            elif n2 == 4:
+                pll_div = (pll_div & ~(0b11 << 6)) | (0b10 << 6)
+            elif n2 == 2:
+                pll_div = (pll_div & ~(0b11 << 6)) | (0b01 << 6)
+            if n1 == 2:
+                pll_div |= (1 << 8)
+            if n3 == 5:
+                pll_div = (pll_div & ~(0b11 << 9)) | (0b11 << 9)
+            elif n3 == 4:
+                pll_div = (pll_div & ~(0b11 << 9)) | (0b10 << 9)
+
+            print('INFO:  Writing SerDes ADPLL divider settings')
+            self.wr_regfile(idx=args.idx, addr=0x51, data=pll_div, mask=0x3FC0)
+
+            if (calib):
+                print('INFO:  Stopping SerDes ADPLL self-calibration')
+                self.wr_regfile(idx=args.idx, addr=0x57, data=0x0004, mask=0x0007)
+                self.wr_regfile(idx=args.idx, addr=0x57, data=
+                    ((self.ADPLL_PFDAC_TIMER    & 0x000F) <<  3) |
+                    ((self.ADPLL_PFDAC_COR_DLY  & 0x0007) << 10) |
+                    ((self.ADPLL_PFDAC_CAL_SIGN & 0x0001) << 13) |
+                    ((self.ADPLL_PFDAC_AUTO_CAL & 0x0001) << 14),
+                    mask=0xFFF8)
+                self.wr_regfile(idx=args.idx, addr=0x58, data=
+                    ((self.ADPLL_PFDAC_COR_DLY  & 0x001F) << 0) |
+                    ((self.ADPLL_PFDAC_CAL_SIGN & 0x001F) << 5) |
+                    ((self.ADPLL_PFDAC_AUTO_CAL & 0x001F) << 10),
+                    mask=0xFFFF)
+
+            print('INFO:  Starting SerDes ADPLL')
+            self.wr_regfile(idx=args.idx, addr=0x50, data=0x0002, mask=0x0007)
+            self.wr_regfile(idx=args.idx, addr=0x50, data=0x0003, mask=0x0003)
+
+            if (calib):
+                print('INFO:  Starting SerDes ADPLL self-calibration')
+                self.wr_regfile(idx=args.idx, addr=0x57, data=0x0004, mask=0x0007)
+                self.wr_regfile(idx=args.idx, addr=0x57, data=0x0005, mask=0x0007) # BISC mode B, enable
+
+        if self.wait_for('PLL_LOCKED', timeout=2.5):
+            print(f'INFO:  SerDes ADPLL locked')
+        else:
+            print(f'ERROR: SerDes ADPLL lock timeout')
+        status = self.rd_regfile_pll_status()
 
         if (calib):
             result = self.rd_regfile_pll_bisc_status()
@@ -1024,10 +2541,65 @@ class SerdesTool:
 
         print(f'INFO:  ADPLL status: LCK: {int(status[0]):1d} FTO: {int(status[1]):1d} FTU: {int(status[2]):1d} FT: {int(status[3:12+1]):4d} SY: {int(status[16:23+1]):3d} ST: {int(status[13:14+1]):1d}')
 
+    # Error counter level at which the BER engine resets RX_PRBS_ERR_CNT
+    PRBS_ERR_CNT_MAX = 0x7FFF
+    PRBS_ERR_CNT_RESET = 0x2000
+
+    def reset_prbs_err_cnt(self):
+        with self.sequence():
+            self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0200, mask=0x0200, verify=False) # RX_PRBS_CNT_RESET=1
+            self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0000, mask=0x0200, verify=False) # RX_PRBS_CNT_RESET=0
+
+    async def ber_measure_async(self, target=1e-9, confidence=0.95, max_time=10.0, interval=0.05) -> dict:
+        """Accumulate PRBS errors until the target BER is proven, disproven or max_time runs out.
+
+        The 15-bit error counter is sampled every interval and reset well before
+        it can saturate; the interval shrinks while errors come in fast.
+        """
+        rate = await self.asubmit(self.line_rate)
+        if not rate:
+            print(f'ERROR: Invalid ADPLL divider settings, cannot compute line rate')
+            return None
+        await self.prepare_record([args.idx])
+        errors, bits, saturated, unlocked = 0, 0, False, 0
+        prev = 0 # the counter runs on between samples until it is reset
+        await self.asubmit(self.reset_prbs_err_cnt)
+        start = last = monotonic()
+        verdict = None
+        while verdict is None:
+            await asyncio.sleep(interval)
+            word = int(await self.asubmit(self.rd_regfile, args.idx, 0x1F, 0xFFFF))
+            now = monotonic()
+            count = word & 0x7FFF
+            unlocked += not (word >> 15)
+            self.record(args.idx, count - prev, rate * (now - last), word >> 15)
+            bits += rate * (now - last)
+            errors += count - prev
+            prev = count
+            saturated |= count >= self.PRBS_ERR_CNT_MAX
+            if count >= self.PRBS_ERR_CNT_RESET:
+                await self.asubmit(self.reset_prbs_err_cnt)
+                prev = 0
+                interval = max(interval / 2, 0.001)
+                now = monotonic() # errors while resetting are not counted, neither are the bits
+            last = now
+            lower, upper = BerLimits(errors, bits, confidence)
+            if upper < target:
+                verdict = 'PASS'
+            elif lower > target or saturated:
+                verdict = 'FAIL'
+            elif now - start >= max_time:
+                verdict = 'INCONCLUSIVE'
+        return {'errors': errors, 'bits': bits, 'ber': errors / bits if bits else 0.0, 'lower': lower, 'upper': upper,
+                'verdict': verdict, 'saturated': saturated, 'unlocked': unlocked, 'time': now - start}
+
+    def ber_measure(self, target=1e-9, confidence=0.95, max_time=10.0) -> dict:
+        return self.run(self.ber_measure_async(target, confidence, max_time))
+
     def tc_prbs(self, force_err=False):
         print(f'INFO:  Starting SerDes PRBS testcases')
 
-        word = self.rd_regfile(args.idx, addr=0x5C)
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
         if (word[0] != 1 or word[2] != 1):
             print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
             return
@@ -1035,7 +2607,7 @@ class SerdesTool:
         # set 80-bit datapath
         self.set_serdes_datapath(80)
 
-        self.start_serdes_pll(n1=1, n2=5, n3=5, outdiv=4, calib=True) # 1250 Mbit/s, PFDAC=on
+        self.start_serdes_pll(rate=1250, calib=True) # PFDAC=on
         self.reset_serdes_trx()
 
         # check datapath
@@ -1044,19 +2616,19 @@ class SerdesTool:
         # disable testmode?
         self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0210, mask=0x02F0) # RX_PRBS_OVR=1, RX_PRBS_SEL=0, RX_PRBS_CNT_RESET=1
 
-        for i in range(0, 2):
+        for i in range(0, 4):
             prbs = 7 if i == 0 else 15 if i == 1 else 23 if i == 2 else 31 if i == 3 else 0
             print(f'INFO:  Setting up PRBS-{prbs}')
 
             self.wr_regfile(idx=args.idx, addr=0x40, data=((i+1) << 6) | (1 << 5), mask=0x01E0) # TX_PRBS_OVR=1, TX_PRBS_SEL=i
-            word = self.rd_regfile(args.idx, addr=0x40)
+            word = self.rd_regfile(args.idx, addr=0x40, mask=0x01C0, fresh=True)
             #if (word[5] == 1):
             #    print(f'ERROR: TX PRBS overwrite is not disabled')
             if (int(word[6:8+1]) != i+1):
                 print(f'ERROR: TX PRBS mode is invalid')
 
             self.wr_regfile(idx=args.idx, addr=0x2A, data=((i+1) << 5) | (1 << 4), mask=0x00F0) # RX_PRBS_OVR=1, RX_PRBS_SEL=i
-            word = self.rd_regfile(args.idx, addr=0x2A)
+            word = self.rd_regfile(args.idx, addr=0x2A, fresh=True)
             #if (word[4] == 1):
             #    print(f'ERROR: RX PRBS overwrite is not disabled')
             if (word[9] == 1):
@@ -1066,17 +2638,21 @@ class SerdesTool:
 
             # send data
             print(f'INFO:  Sending data (this might take a while) ...')
-            n = 10
-            for i in range(n):
-                print(f'INFO:  {i}/{n}')
-                sleep(1)
-
-            word = self.rd_regfile(args.idx, addr=0x1F)
-            print(f'INFO:  RX_PRBS_LOCKED: {int(word[15]):1d}, RX_PRBS_ERR_CNT: {int(word[0:14+1]):X}')
-            if (word[15] == 0):
+            if not self.wait_for('RX_PRBS_LOCKED', timeout=10):
                 print(f'ERROR: RX PRBS did not lock')
-            if (int(word[0:14+1]) > 0):
-                print(f'ERROR: RX PRBS errors detected ({int(word[0:14+1])})')
+
+            ber = self.ber_measure(target=args.ber, confidence=args.bercl, max_time=args.bertime)
+            if ber is not None:
+                print(f'INFO:  PRBS-{prbs}: {ber["errors"]} errors in {ber["bits"]:.3e} bits ({ber["time"]:.1f} s), '
+                      f'BER {ber["ber"]:.3e}, {100*args.bercl:g}% CL [{ber["lower"]:.3e}, {ber["upper"]:.3e}]: {ber["verdict"]}')
+                if ber['unlocked']:
+                    print(f'ERROR: RX PRBS lost lock in {ber["unlocked"]} samples')
+                if ber['saturated']:
+                    print(f'ERROR: RX_PRBS_ERR_CNT saturated')
+                if ber['verdict'] == 'FAIL':
+                    print(f'ERROR: RX PRBS BER above {args.ber:.1e}')
+                elif ber['errors'] > 0:
+                    print(f'ERROR: RX PRBS errors detected ({ber["errors"]})')
 
             if (force_err):
                 print(f'INFO:  Starting error injection')
@@ -1088,6 +2664,7 @@ class SerdesTool:
 
             self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0210, mask=0x02F0) # RX_PRBS_CNT_RESET=1, RX_PRBS_OVR=1, RX_PRBS_SEL=0
             self.wr_regfile(idx=args.idx, addr=0x40, data=0x0020, mask=0x01E0) # TX_PRBS_OVR=1, TX_PRBS_SEL=0
+        self.verify_writes()
         return
 
     def tc_uipattern(self, mode=0):
@@ -1097,7 +2674,7 @@ class SerdesTool:
             print(f'ERROR: Invalid UI pattern mode ({mode}), must be in [0,2,20,40,80]')
             return
 
-        word = self.rd_regfile(args.idx, addr=0x5C)
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
         if (word[0] != 1 or word[2] != 1):
             print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
             return
@@ -1105,7 +2682,7 @@ class SerdesTool:
         # set datapath if mode in [20,40,80]
         self.set_serdes_datapath(mode)
 
-        self.start_serdes_pll(n1=1, n2=2, n3=3, outdiv=4, calib=True) # 300 Mbit/s, PFDAC=on
+        self.start_serdes_pll(rate=300, calib=True) # PFDAC=on
         self.reset_serdes_trx()
 
         # check datapath
@@ -1118,22 +2695,295 @@ class SerdesTool:
 
         i = 5 if mode == 2 else 6 if mode in [20,40,80] else 0
         self.wr_regfile(idx=args.idx, addr=0x40, data=((i+1) << 6) | (1 << 5), mask=0x01E0) # TX_PRBS_OVR=1, TX_PRBS_SEL=i
-        word = self.rd_regfile(args.idx, addr=0x40)
+        word = self.rd_regfile(args.idx, addr=0x40, mask=0x01C0, fresh=True)
         if (int(word[6:8+1]) != i+1):
             print(f'ERROR: TX PRBS mode is invalid')
+        self.verify_writes()
+
+    def start_prbs_link(self):
+        """Brings up a 1250 Mbit/s PRBS-31 link on args.idx and waits for RX lock."""
+        # set 80-bit datapath
+        self.set_serdes_datapath(80)
+
+        self.start_serdes_pll(rate=1250, calib=True) # PFDAC=on
+        self.reset_serdes_trx()
+
+        # check datapath
+        self.check_serdes_datapath(80)
 
-    def tc_eyemeas(self):
+        self.wr_regfile(idx=args.idx, addr=0x40, data=(4 << 6) | (1 << 5), mask=0x01E0) # TX_PRBS_OVR=1, TX_PRBS_SEL=PRBS-31
+        self.wr_regfile(idx=args.idx, addr=0x2A, data=(4 << 5) | (1 << 4), mask=0x02F0) # RX_PRBS_OVR=1, RX_PRBS_SEL=PRBS-31
+        if not self.wait_for('RX_PRBS_LOCKED', timeout=10):
+            print(f'ERROR: RX PRBS did not lock')
+
+    def stop_prbs_link(self):
+        self.wr_regfile(idx=args.idx, addr=0x2A, data=0x0210, mask=0x02F0) # RX_PRBS_CNT_RESET=1, RX_PRBS_OVR=1, RX_PRBS_SEL=0
+        self.wr_regfile(idx=args.idx, addr=0x40, data=0x0020, mask=0x01E0) # TX_PRBS_OVR=1, TX_PRBS_SEL=0
+        self.verify_writes()
+
+    def wr_fields(self, values):
+        """Writes {name: value} on args.idx with one write per regfile word."""
+        with self.sequence():
+            for (addr, (data, mask)) in self.regfile.pack(values).items():
+                self.wr_regfile(idx=args.idx, addr=addr, data=data, mask=mask, verify=False)
+
+    async def prbs_window_async(self, rate, dwell, settle=0.01) -> dict:
+        """Counts PRBS errors on args.idx for one dwell window."""
+        await asyncio.sleep(settle)
+        await self.asubmit(self.reset_prbs_err_cnt)
+        start = monotonic()
+        await asyncio.sleep(dwell)
+        word = int(await self.asubmit(self.rd_regfile, args.idx, 0x1F, 0xFFFF))
+        return {'bits': rate * (monotonic() - start), 'errors': word & 0x7FFF, 'locked': word >> 15}
+
+    # default eye sweep: RX equalizer low/high frequency boost
+    EYE_SWEEP = (('RX_EQA_CKP_LF', list(range(0, 256, 32))), ('RX_EQA_CKP_HF', list(range(0, 256, 32))))
+    EYE_CHECKPOINT_INTERVAL = 5.0 # seconds between checkpoint writes
+
+    def load_eye_checkpoint(self, path, spec) -> dict:
+        """Returns the points measured so far by a sweep with the same spec."""
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'ERROR: Cannot read sweep checkpoint {path}: {e}')
+            return None
+        if data.get('spec') != spec:
+            print(f'ERROR: Sweep checkpoint {path} belongs to a different sweep, remove it to start over')
+            return None
+        return data.get('points', {})
+
+    def save_eye_checkpoint(self, path, spec, points):
+        # stored rows first, so a resumed sweep never skips a point the store lacks
+        if self.store is not None:
+            self.store.flush()
+        if not path:
+            return
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'spec': spec, 'points': points}, f)
+        os.replace(tmp, path)
+
+    async def eye_sweep_async(self, axes, devices, dwell, settle, points, on_point=None):
+        """Measures PRBS errors at every point of the axes grid not yet in points.
+
+        All devices get the same settings in one broadcast scan and dwell
+        together. The error counters of a point are read in the same flush
+        that writes the next point, so each point costs two cable round trips.
+        """
+        names = [name for (name, values) in axes]
+        rate = await self.asubmit(self.line_rate)
+        if not rate:
+            print(f'ERROR: Invalid ADPLL divider settings, cannot compute line rate')
+            return points
+        await self.prepare_record(devices)
+        pending = None # (key, start) of the point whose counters are still running
+
+        def step(values):
+            with self.sequence():
+                words = [self.rd_regfile_burst(idx, [0x1F], deferred=True)[0] for idx in devices] if pending else []
+                self.wr_fields(values)
+            return [int(self._tool.result(word)) for word in words]
+
+        def finish(words):
+            key, start = pending
+            bits = rate * (monotonic() - start)
+            points[key] = {'bits': bits, 'errors': [word & 0x7FFF for word in words], 'locked': [word >> 15 for word in words]}
+            for (idx, word) in zip(devices, words):
+                self.record(idx, word & 0x7FFF, bits, word >> 15)
+            if on_point:
+                on_point(key, points[key])
+
+        for point in product(*[values for (name, values) in axes]):
+            key = ','.join(map(str, point))
+            if key in points:
+                continue
+            words = await self.asubmit(step, dict(zip(names, point)))
+            if pending:
+                finish(words)
+            await asyncio.sleep(settle)
+            await self.asubmit(self.reset_prbs_err_cnt)
+            pending = (key, monotonic())
+            await asyncio.sleep(dwell)
+        if pending:
+            finish(await self.asubmit(step, {}))
+        return points
+
+    def tc_eyemeas(self, axes=None, dwell=0.1, settle=0.01, checkpoint=None):
         print(f'INFO:  Starting SerDes eye measurement')
 
-        word = self.rd_regfile(args.idx, addr=0x5C)
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
         if (word[0] != 1 or word[2] != 1):
             print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
             return
 
+        axes = [[name, list(values)] for (name, values) in (axes or self.EYE_SWEEP)]
+        devices = (args.idx,) + tuple(i for i in self.broadcast if i != args.idx)
+        spec = {'axes': axes, 'devices': list(devices), 'dwell': dwell}
+        points = self.load_eye_checkpoint(checkpoint, spec)
+        if points is None:
+            return
+        total = math.prod(len(values) for (name, values) in axes)
+        if points:
+            print(f'INFO:  Resuming sweep from {checkpoint}: {len(points)}/{total} points done')
+
+        self.start_prbs_link()
+
+        # remember the swept bits of every device to restore them afterwards
+        swept = self.regfile.pack({name: 0 for (name, values) in axes})
+        original = {idx: dict(zip(swept, self.rd_regfile_burst(idx, swept))) for idx in devices}
+
+        def label(key):
+            return ' '.join(f'{name}={v}' for ((name, values), v) in zip(axes, key.split(',')))
+
+        last = monotonic()
+        def on_point(key, point):
+            nonlocal last
+            print(f'INFO:  [{len(points):{len(str(total))}}/{total}] {label(key)}: '
+                  f'errors {" ".join(f"{e:5d}" + ("" if l else "!") for (e, l) in zip(point["errors"], point["locked"]))}')
+            if monotonic() - last >= self.EYE_CHECKPOINT_INTERVAL:
+                self.save_eye_checkpoint(checkpoint, spec, points)
+                last = monotonic()
+
+        try:
+            self.run(self.eye_sweep_async(axes, devices, dwell, settle, points, on_point))
+        finally:
+            self.save_eye_checkpoint(checkpoint, spec, points)
+            # per-device values, so no broadcast here
+            broadcast, self.broadcast = self.broadcast, ()
+            try:
+                with self.sequence():
+                    for (idx, words) in original.items():
+                        for (addr, word) in words.items():
+                            self.wr_regfile(idx=idx, addr=addr, data=int(word), mask=swept[addr][1], verify=False)
+            finally:
+                self.broadcast = broadcast
+
+        # widest margin is what matters, report the error free area and the best point per device
+        for (i, idx) in enumerate(devices):
+            results = [(p['errors'][i] / p['bits'] if p['bits'] else 1.0, key) for (key, p) in points.items() if p['locked'][i]]
+            clean = sum(ber == 0 for (ber, key) in results)
+            if not results:
+                print(f'ERROR: Device {idx}: RX PRBS unlocked at every sweep point')
+                continue
+            ber, key = min(results)
+            print(f'INFO:  Device {idx}: {clean}/{len(points)} points error free, best {label(key)} (BER {ber:.3e})')
+
+        self.stop_prbs_link()
+
+    TX_OPT_FIELDS = ('TX_SEL_PRE', 'TX_SEL_POST', 'TX_AMP')
+    TX_OPT_STEP = 8 # initial coordinate step, halved down to 1
+    TX_OPT_DWELL_GROWTH = 4
+    TX_OPT_MAX_DWELL_GROWTH = 64
+
+    async def tx_optimize_async(self, dwell=0.1, settle=0.01, budget=64, min_swing=0.2):
+        """Coordinate descent over TX_OPT_FIELDS with the PRBS error rate as objective.
+
+        Starting at the current setting, each field is stepped up and down and
+        the first improvement is taken; the step halves when no move helps.
+        Settings whose modeled de-emphasis level Vb is not positive or whose
+        signal voltage Va is below min_swing are never transmitted. Once the
+        best setting sees no errors the dwell window grows by DWELL_GROWTH, up
+        to MAX_DWELL_GROWTH times the initial one, so the error rate keeps
+        telling settings apart. At most budget dwell windows are spent.
+        Returns (best values, best result, windows).
+        """
+        rate = await self.asubmit(self.line_rate)
+        if not rate:
+            print(f'ERROR: Invalid ADPLL divider settings, cannot compute line rate')
+            return None, None, 0
+        await self.prepare_record([args.idx])
+        fields = [self.regfile.fields[name] for name in self.TX_OPT_FIELDS]
+        words = dict(zip((0x30, 0x31, 0x32), await self.asubmit(self.rd_regfile_burst, args.idx, (0x30, 0x31, 0x32))))
+
+        def current(name):
+            field = self.regfile.fields[name]
+            return field.decode(words[field.addr])
+
+        def voltages(values):
+            return self.tx_voltages(lambda name: values[name] if name in values else current(name))
+
+        def feasible(values):
+            txuc, va, vb, vc, vd = voltages(values)
+            return vb > 0 and va >= min_swing
+
+        results = {}
+        window = dwell
+        async def score(values):
+            key = (tuple(values[field.name] for field in fields), window)
+            if key not in results:
+                if len(results) >= budget:
+                    return None
+                await self.asubmit(self.wr_fields, values)
+                result = await self.prbs_window_async(rate, window, settle)
+                self.record(args.idx, result['errors'], result['bits'], result['locked'])
+                # unlocked is worse than any error count
+                result['ber'] = result['errors'] / result['bits'] if result['locked'] and result['bits'] else math.inf
+                results[key] = result
+                txuc, va, vb, vc, vd = voltages(values)
+                print(f'INFO:  [{len(results):3}/{budget}] {" ".join(f"{n}={v:2d}" for (n, v) in values.items())} '
+                      f'Va {va:.3f} V Vb {vb:.3f} V: {result["errors"]} errors in {window:g} s{"" if result["locked"] else ", unlocked"}')
+            return results[key]['ber']
+
+        best = {field.name: current(field.name) for field in fields}
+        if not feasible(best):
+            best.update(TX_SEL_PRE=0, TX_SEL_POST=0)
+        if not feasible(best):
+            print(f'ERROR: TX setting violates the voltage constraints even without emphasis')
+            return None, None, 0
+        best_ber = await score(best)
+        step = self.TX_OPT_STEP
+        while step and best_ber is not None and len(results) < budget:
+            if best_ber == 0:
+                if window >= self.TX_OPT_MAX_DWELL_GROWTH * dwell:
+                    break
+                window *= self.TX_OPT_DWELL_GROWTH
+                best_ber = await score(best)
+                continue
+            improved = False
+            for field in fields:
+                for d in (step, -step):
+                    values = dict(best, **{field.name: min(max(best[field.name] + d, 0), field.max)})
+                    if values == best or not feasible(values):
+                        continue
+                    ber = await score(values)
+                    if ber is not None and ber < best_ber:
+                        best, best_ber, improved = values, ber, True
+                        break
+            if not improved:
+                step //= 2
+        return best, results[(tuple(best[field.name] for field in fields), window)], len(results)
+
+    def tc_txopt(self, dwell=0.1, budget=64, min_swing=0.2):
+        print(f'INFO:  Starting SerDes TX emphasis optimization')
+
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
+        if (word[0] != 1 or word[2] != 1):
+            print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
+            return
+
+        self.start_prbs_link()
+        best, result, windows = self.run(self.tx_optimize_async(dwell=dwell, budget=budget, min_swing=min_swing))
+        if best is not None:
+            # leave the best setting applied and qualify it with a full BER measurement
+            self.wr_fields(best)
+            txuc, va, vb, vc, vd = self.tx_voltages(self.rd_field)
+            print(f'INFO:  Best TX setting after {windows} windows: {" ".join(f"{n}={v}" for (n, v) in best.items())}, '
+                  f'Va {va:.3f} V Vb {vb:.3f} V Vc {vc:.3f} V Vd {vd:.3f} V')
+            ber = self.ber_measure(target=args.ber, confidence=args.bercl, max_time=args.bertime)
+            if ber is not None:
+                print(f'INFO:  {ber["errors"]} errors in {ber["bits"]:.3e} bits, BER {ber["ber"]:.3e}, '
+                      f'{100*args.bercl:g}% CL [{ber["lower"]:.3e}, {ber["upper"]:.3e}]: {ber["verdict"]}')
+                if ber['verdict'] == 'FAIL':
+                    print(f'ERROR: RX PRBS BER above {args.ber:.1e} at the best TX setting')
+        self.stop_prbs_link()
+
     def tc_loopback(self):
         print(f'INFO:  Starting SerDes loopback testcases')
 
-        word = self.rd_regfile(args.idx, addr=0x5C)
+        word = self.rd_regfile(args.idx, addr=0x5C, fresh=True)
         if (word[0] != 1 or word[2] != 1):
             print(f'ERROR: SerDes not enabled or in testmode. 0x5C=0x{int(word):04X}')
             return
@@ -1149,57 +2999,61 @@ class SerdesTool:
             else:
                 print(f'\nINFO:  Enabling TX PCS Loopback')
 
-            # TX_LOOPBACK_OVR=1 | TX_PMA_LOOPBACK=(001=pma-drv, 011=pma-drv, 010=pma-pad, 100=pcs)
-            self.wr_regfile(idx=args.idx, addr=0x40, data=(0x0400 | (j+1) & 0x7), mask=0x0407)
-            word = self.rd_regfile(args.idx, addr=0x40)
-            if (word[10] == 0):
-                print(f'ERROR: TX loopback overwrite is not enabled')
-            if (int(word[0:1+1]) != j+1 and j < 3):
-                print(f'ERROR: TX PMA loopback is not enabled')
-            if (word[2] == 0 and j == 3):
-                print(f'ERROR: TX PCS loopback is not enabled')
-
-            # turn tx driver off
-            if (j == 1 or j == 3):
-                self.wr_regfile(idx=args.idx, addr=0x30, data=0x0000, mask=0x001F) # TODO TX_SEL_PRE=0, TX_SEL_POST=x, TX_AMP=x
-                self.wr_regfile(idx=args.idx, addr=0x31, data=0x07E0, mask=0x07E0) # TX_BRANCH_EN_MAIN=63
-                word = self.rd_regfile(args.idx, addr=0x30)
-                if (int(word[0:4+1]) != 0):
-                    print(f'ERROR: Invalid TX_SEL_PRE driver setting')
-                word = self.rd_regfile(args.idx, addr=0x31)
-                if (int(word[5:10+1]) != 63):
-                    print(f'ERROR: Invalid TX_BRANCH_EN_MAIN setting')
-            else:
-                self.wr_regfile(idx=args.idx, addr=0x30, data=0x0001, mask=0x001F) # TODO TX_SEL_PRE=1, TX_SEL_POST=x, TX_AMP=x
-                self.wr_regfile(idx=args.idx, addr=0x31, data=0x0000, mask=0x07E0) # TX_BRANCH_EN_MAIN=0
-                word = self.rd_regfile(args.idx, addr=0x30)
-                if (int(word[0:4+1]) != 1):
-                    print(f'ERROR: Invalid TX_SEL_PRE driver setting')
-                word = self.rd_regfile(args.idx, addr=0x31)
-                if (int(word[5:10+1]) != 0):
-                    print(f'ERROR: Invalid TX_BRANCH_EN_MAIN setting')
-
-            self.start_serdes_pll(n1=1, n2=5, n3=5, outdiv=4, calib=True) # 1250 Mbit/s, PFDAC=on
+            with self.sequence():
+                # TX_LOOPBACK_OVR=1 | TX_PMA_LOOPBACK=(001=pma-drv, 011=pma-drv, 010=pma-pad, 100=pcs)
+                self.wr_regfile(idx=args.idx, addr=0x40, data=(0x0400 | (j+1) & 0x7), mask=0x0407)
+                word = self.rd_regfile(args.idx, addr=0x40, mask=0x0407, fresh=True)
+                if (word[10] == 0):
+                    print(f'ERROR: TX loopback overwrite is not enabled')
+                if (int(word[0:1+1]) != j+1 and j < 3):
+                    print(f'ERROR: TX PMA loopback is not enabled')
+                if (word[2] == 0 and j == 3):
+                    print(f'ERROR: TX PCS loopback is not enabled')
+
+                # turn tx driver off
+                if (j == 1 or j == 3):
+                    self.wr_regfile(idx=args.idx, addr=0x30, data=0x0000, mask=0x001F) # TODO TX_SEL_PRE=0, TX_SEL_POST=x, TX_AMP=x
+                    self.wr_regfile(idx=args.idx, addr=0x31, data=0x07E0, mask=0x07E0) # TX_BRANCH_EN_MAIN=63
+                    word = self.rd_regfile(args.idx, addr=0x30, mask=0x001F, fresh=True)
+                    if (int(word[0:4+1]) != 0):
+                        print(f'ERROR: Invalid TX_SEL_PRE driver setting')
+                    word = self.rd_regfile(args.idx, addr=0x31, mask=0x07E0, fresh=True)
+                    if (int(word[5:10+1]) != 63):
+                        print(f'ERROR: Invalid TX_BRANCH_EN_MAIN setting')
+                else:
+                    self.wr_regfile(idx=args.idx, addr=0x30, data=0x0001, mask=0x001F) # TODO TX_SEL_PRE=1, TX_SEL_POST=x, TX_AMP=x
+                    self.wr_regfile(idx=args.idx, addr=0x31, data=0x0000, mask=0x07E0) # TX_BRANCH_EN_MAIN=0
+                    word = self.rd_regfile(args.idx, addr=0x30, mask=0x001F, fresh=True)
+                    if (int(word[0:4+1]) != 1):
+                        print(f'ERROR: Invalid TX_SEL_PRE driver setting')
+                    word = self.rd_regfile(args.idx, addr=0x31, mask=0x07E0, fresh=True)
+                    if (int(word[5:10+1]) != 0):
+                        print(f'ERROR: Invalid TX_BRANCH_EN_MAIN setting')
+
+            self.start_serdes_pll(rate=1250, calib=True) # PFDAC=on
             self.reset_serdes_trx()
 
-            self.wr_regfile(idx=args.idx, addr=0x41, data=0x00C0, mask=0x00C0) # TX_8B10B_EN_OVR=1, TX_8B10B_EN=1
-            self.wr_regfile(idx=args.idx, addr=0x2B, data=0xC000, mask=0xC000) # RX_8B10B_EN_OVR=1, RX_8B10B_EN=1
+            with self.sequence():
+                self.wr_regfile(idx=args.idx, addr=0x41, data=0x00C0, mask=0x00C0) # TX_8B10B_EN_OVR=1, TX_8B10B_EN=1
+                self.wr_regfile(idx=args.idx, addr=0x2B, data=0xC000, mask=0xC000) # RX_8B10B_EN_OVR=1, RX_8B10B_EN=1
 
-            # 32-Bit comma alignment test
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x3000, mask=0x3000) # RX_ALIGN_COMMA_WORD=3 (32 bit)
+                # 32-Bit comma alignment test
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x3000, mask=0x3000) # RX_ALIGN_COMMA_WORD=3 (32 bit)
 
-            # NOTE: Please define position of the k-word using the `TX_CHAR_IS_K_I` input: set to 8'h0000_0001
-            #self.wr_regfile_tx_data(data=0x1284A1284A1284A128BC) # 64'h4A4A4A4A_4A4A4ABC
+                # NOTE: Please define position of the k-word using the `TX_CHAR_IS_K_I` input: set to 8'h0000_0001
+                #self.wr_regfile_tx_data(data=0x1284A1284A1284A128BC) # 64'h4A4A4A4A_4A4A4ABC
 
-            self.wr_regfile(idx=args.idx, addr=0x11, data=0x0C00, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=1
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0C00, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=1
-            self.wr_regfile(idx=args.idx, addr=0x13, data=0x3000, mask=0x3000) # RX_COMMA_DETECT_EN_OVR=1, RX_COMMA_DETECT_EN=1
+                self.wr_regfile(idx=args.idx, addr=0x11, data=0x0C00, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=1
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0C00, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=1
+                self.wr_regfile(idx=args.idx, addr=0x13, data=0x3000, mask=0x3000) # RX_COMMA_DETECT_EN_OVR=1, RX_COMMA_DETECT_EN=1
 
             print(f'INFO:  Sending data (this might take a while) ...')
-            sleep(2)
+            if not self.wait_for('RX_BYTE_IS_ALIGNED', timeout=2):
+                print(f'ERROR: RX_BYTE_IS_ALIGNED timeout')
 
-            self.wr_regfile(idx=args.idx, addr=0x11, data=0x0000, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=0
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=0
+            with self.sequence():
+                self.wr_regfile(idx=args.idx, addr=0x11, data=0x0000, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=0
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=0
 
             print(f'INFO:  Checking 32-Bit comma alignment')
             rx_data, _ = self.rd_regfile_rx_data()
@@ -1213,20 +3067,23 @@ class SerdesTool:
 
             # 16-Bit comma alignment test
             self.reset_serdes_trx()
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x1000, mask=0x3000) # RX_ALIGN_COMMA_WORD=1 (16 bit)
+            with self.sequence():
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x1000, mask=0x3000) # RX_ALIGN_COMMA_WORD=1 (16 bit)
 
-            # NOTE: Please define position of the k-word using the `TX_CHAR_IS_K_I` input: set to 8'h0000_0001
-            self.wr_regfile_tx_data(data=0x1284A1284A1284A128BC) # 64'h4A4A4A4A_4A4A4ABC
+                # NOTE: Please define position of the k-word using the `TX_CHAR_IS_K_I` input: set to 8'h0000_0001
+                self.wr_regfile_tx_data(data=0x1284A1284A1284A128BC) # 64'h4A4A4A4A_4A4A4ABC
 
-            self.wr_regfile(idx=args.idx, addr=0x11, data=0x0C00, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=1
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0C00, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=1
-            self.wr_regfile(idx=args.idx, addr=0x13, data=0x3000, mask=0x3000) # RX_COMMA_DETECT_EN_OVR=1, RX_COMMA_DETECT_EN=1
+                self.wr_regfile(idx=args.idx, addr=0x11, data=0x0C00, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=1
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0C00, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=1
+                self.wr_regfile(idx=args.idx, addr=0x13, data=0x3000, mask=0x3000) # RX_COMMA_DETECT_EN_OVR=1, RX_COMMA_DETECT_EN=1
 
             print(f'INFO:  Sending data (this might take a while) ...')
-            sleep(2)
+            if not self.wait_for('RX_BYTE_IS_ALIGNED', timeout=2):
+                print(f'ERROR: RX_BYTE_IS_ALIGNED timeout')
 
-            self.wr_regfile(idx=args.idx, addr=0x11, data=0x0000, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=0
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=0
+            with self.sequence():
+                self.wr_regfile(idx=args.idx, addr=0x11, data=0x0000, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=0
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=0
 
             print(f'INFO:  Checking 16-Bit comma alignment')
             rx_data, _ = self.rd_regfile_rx_data()
@@ -1244,20 +3101,23 @@ class SerdesTool:
 
             # 8-Bit comma alignment test
             self.reset_serdes_trx()
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x3000) # RX_ALIGN_COMMA_WORD=0 (8 bit)
+            with self.sequence():
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x3000) # RX_ALIGN_COMMA_WORD=0 (8 bit)
 
-            # NOTE: Please define position of the k-word using the `TX_CHAR_IS_K_I` input: set to 8'h0000_0001
-            self.wr_regfile_tx_data(data=0x1284A1284A1284A128BC) # 64'h4A4A4A4A_4A4A4ABC
+                # NOTE: Please define position of the k-word using the `TX_CHAR_IS_K_I` input: set to 8'h0000_0001
+                self.wr_regfile_tx_data(data=0x1284A1284A1284A128BC) # 64'h4A4A4A4A_4A4A4ABC
 
-            self.wr_regfile(idx=args.idx, addr=0x11, data=0x0C00, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=1
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0C00, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=1
-            self.wr_regfile(idx=args.idx, addr=0x13, data=0x3000, mask=0x3000) # RX_COMMA_DETECT_EN_OVR=1, RX_COMMA_DETECT_EN=1
+                self.wr_regfile(idx=args.idx, addr=0x11, data=0x0C00, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=1
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0C00, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=1
+                self.wr_regfile(idx=args.idx, addr=0x13, data=0x3000, mask=0x3000) # RX_COMMA_DETECT_EN_OVR=1, RX_COMMA_DETECT_EN=1
 
             print(f'INFO:  Sending data (this might take a while) ...')
-            sleep(2)
+            if not self.wait_for('RX_BYTE_IS_ALIGNED', timeout=2):
+                print(f'ERROR: RX_BYTE_IS_ALIGNED timeout')
 
-            self.wr_regfile(idx=args.idx, addr=0x11, data=0x0000, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=0
-            self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=0
+            with self.sequence():
+                self.wr_regfile(idx=args.idx, addr=0x11, data=0x0000, mask=0x0C00) # RX_MCOMMA_ALIGN_OVR=1, RX_MCOMMA_ALIGN=0
+                self.wr_regfile(idx=args.idx, addr=0x12, data=0x0000, mask=0x0C00) # RX_PCOMMA_ALIGN_OVR=1, RX_PCOMMA_ALIGN=0
 
             print(f'INFO:  Checking 8-Bit comma alignment')
             rx_data, _ = self.rd_regfile_rx_data()
@@ -1283,27 +3143,54 @@ class SerdesTool:
 
     def calc_rxterm_vcm(self, vddio=1.0, vcmsel=None) -> float:
         if vcmsel is None:
-            vcmsel = self.rd_regfile(args.idx, addr=0x02)
+            vcmsel = self.rd_regfile(args.idx, addr=0x02, mask=0x3800)
             vcmsel = int(vcmsel[11:13+1])
         return (vcmsel/29) * vddio
 
-    def update_values(self):
-        while True:
-            sleep(0.5) # 500ms update interval
-            with self.param_lock:
-                #for param in self.regfile.fields:
-                #    self.regfile.fields[param]['val'] = random.randint(0, 16)
-                for addr in chain(range(0x00, 0x30), range(0x30, 0x43), range(0x50, 0x5D)):
-                    word = self.rd_regfile(args.idx, addr)
-                    filtered_entries = {key: value for key, value in self.regfile.fields.items() if value['addr'] == addr}
-                    for (key, value) in filtered_entries.items():
-                        val = word[value['lbit']:value['hbit']+1]
-                        self.regfile.fields[key]['val'] = int(val)
+    def update_values(self, sink=None, interval=None, until=None, stop=None):
+        """Polls the regfile, publishing every snapshot and passing it to sink(time, words).
+
+        With an interval the poller runs at that rate or as fast as the cable
+        allows. Polling ends at until or once the stop event is set.
+        """
+        addrs = chain(range(0x00, 0x30), range(0x30, 0x43), range(0x50, 0x5D))
+        # a fixed interval may use the whole cable
+        poller = SerdesPoller(self, args.idx, addrs, ArgHzParse(args.freq), interval, None if interval is None else 1.0)
+        prev = None
+        stop = stop or threading.Event()
+        while until is None or monotonic() < until:
+            if stop.wait(poller.wait()):
+                break
+            # read into a private snapshot, then publish it with a single swap
+            snap = poller.poll(prev).freeze()
+            if sink is not None:
+                sink(time(), snap.words)
+            changed = snap.diff(prev)
+            self.published = snap
+            if changed:
+                self._updates += 1
+            prev = snap
+
+    def record_telemetry(self, filename, interval=0.0, duration=None):
+        print(f'INFO:  Recording regfile snapshots of device {args.idx} to {filename}, press Ctrl-C to stop')
+        recorder = TelemetryRecorder(filename, self.regfile.size, {'idx': args.idx, 'serial': args.serial, 'freq': args.freq}).start()
+        start = monotonic()
+        try:
+            self.update_values(sink=recorder.push, interval=interval, until=None if duration is None else start + duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            recorder.stop()
+        elapsed = monotonic() - start
+        print(f'INFO:  Recorded {recorder.records} snapshots in {elapsed:.1f} s ({recorder.records / elapsed:.1f}/s), '
+              f'{recorder.size} bytes ({recorder.size / max(recorder.records, 1):.1f} bytes/snapshot)')
+        if recorder.dropped:
+            print(f'ERROR: {recorder.dropped} snapshots dropped, the log writer could not keep up')
 
     def draw_parameters(self, stdscr):
         curses.curs_set(0)
         stdscr.keypad(True)
-        stdscr.timeout(10) #stdscr.nodelay(True)  # Non-blocking input
+        stdscr.timeout(50) #stdscr.nodelay(True)  # Non-blocking input
 
         # Initialize colors
         curses.start_color()
@@ -1313,158 +3200,134 @@ class SerdesTool:
         curses.init_pair(4, curses.COLOR_BLUE, curses.COLOR_BLACK)    # OVR (Blue)
         curses.init_pair(5, curses.COLOR_WHITE, curses.COLOR_BLACK)   # Normal text
 
-        def handle_resize(signum, frame):
+        frame = CursesFrame(stdscr)
+
+        def handle_resize(signum, frame_):
             curses.endwin()
             stdscr.refresh()
+            frame.invalidate()
 
         signal.signal(signal.SIGWINCH, handle_resize)
 
+        # status lines derived from regfile fields, rebuilt only when their inputs change
+        def pll_strings(main_divsel, out_divsel, fcntrl, datapath_sel):
+            point = self.pll_table.lookup(main_divsel, out_divsel, fcntrl, datapath_sel)
+            return (f"Reference Clock:  {args.refclk / 1e6:.3f} MHz",
+                    f"DCO Frequency:   {point['dco'] / 1e6:.3f} MHz" if point else "Invalid PLL Config",
+                    f"Bit Rate Clock:  {point['bit_rate'] / 1e6:.3f} MHz" if point else "Invalid PLL Config",
+                    f"TX Datapath Clock: {point['datapath_clock'] / 1e6:.3f} MHz" if point else "Invalid Data Path Config")
+
+        def tx_strings(*values):
+            txuc, va, vb, vc, vd = self.tx_voltages(dict(zip(self.TX_VOLTAGE_FIELDS, values)).get)
+            return (f"TX Unit Current:      {txuc} uA",
+                    f"TX Boost Voltage:     {vd:.3f} V",
+                    f"TX Pre-emph. Voltage: {vc:.3f} V",
+                    f"TX De-emph. Voltage:  {vb:.3f} V",
+                    f"TX Signal Voltage:    {va:.3f} V")
+
+        def vcm_string(vcm_sel):
+            rx_rterm_vcm = args.vcore * (18 + vcm_sel) / 29
+            return f"RX RTERM VCM:     {rx_rterm_vcm:.3f} V"
+
+        def rx_data_strings(datapath_sel, *words):
+            datapath_width = PllTable.WIDTHS.get(datapath_sel, 80)
+            word80 = 0
+            for word in words:
+                word80 = (word80 << 16) | word
+
+            word64 = 0
+            for bit_offset in range(0, 80, 10):
+                word64 |= ((word80 >> bit_offset) & 0xFF) << int((bit_offset * 8)/10)
+            return (f"RX_DATA[79:0]: 0x{word80:0{int(datapath_width/4)}X}",
+                    f"RX_DATA[63:0]: 0x{word64:016X}")
+
+        derived = DerivedCache(self.value)
+
         selected_index = 0
+        top_row = 0
         show_hex = True
         search_results = []
         search_index = 0
 
         while True:
-            max_y, max_x = stdscr.getmaxyx()
+            drawn = self._updates
+            frame.begin()
+            max_y, max_x = frame.max_y, frame.max_x
             max_name_length = max(len(name) for name in self.regfile.fields.keys())
             col_width = max_name_length + 8
             num_columns = max(1, max_x // col_width)
             num_rows = math.ceil(len(self.regfile.fields) / num_columns)
             param_list = list(self.regfile.fields.items())
 
-            # Extract values for bit rate calculation
-            PLL_MAIN_DIVSEL = self.regfile.fields.get("PLL_MAIN_DIVSEL", {}).get("val", 0x1B)
-            PLL_OUT_DIVSEL = self.regfile.fields.get("PLL_OUT_DIVSEL", {}).get("val", 0x0)
-            TX_DATAPATH_SEL = self.regfile.fields.get("TX_DATAPATH_SEL", {}).get("val", 0x0)
-
-            # Decode PLL values
-            N3 = {0b00: 3, 0b10: 4, 0b11: 5}.get((PLL_MAIN_DIVSEL >> 3) & 0b11, None)
-            N1 = {0b0: 1, 0b1: 2}.get((PLL_MAIN_DIVSEL >> 2) & 0b1, None)
-            N2 = {0b00: 3, 0b01: 2, 0b10: 4, 0b11: 5}.get(PLL_MAIN_DIVSEL & 0b11, None)
-            OUTDIV = {0b00: 1, 0b01: 2, 0b11: 4}.get(PLL_OUT_DIVSEL, None)
-
-            bit_rate_clock = 2 * args.refclk * N1 * N2 * N3 / OUTDIV if None not in (N1, N2, N3, OUTDIV) else None
-
-            # Decode TX_DATAPATH_SEL
-            if (TX_DATAPATH_SEL == 0):
-                datapath_width = 20
-            elif (TX_DATAPATH_SEL == 1):
-                datapath_width = 40
-            else:
-                datapath_width = 80
-
-            # Determine AddDiv based on OUTDIV
-            if datapath_width == 80:
-                AddDiv = {0b00: 2, 0b01: 4, 0b11: 8}.get(PLL_OUT_DIVSEL, None)
-            else:
-                AddDiv = {0b00: 1, 0b01: 2, 0b11: 4}.get(PLL_OUT_DIVSEL, None)
-
-            PLL_FCNTRL = self.regfile.fields.get("PLL_FCNTRL", {}).get("val", 0x0)
-            fDCO = args.refclk * N1 * N2 * N3
-            data_path_clock = fDCO / (self.olclkg[PLL_FCNTRL] * AddDiv) if None not in (N1, N2, N3, OUTDIV, AddDiv) else None
-
-            refclk_str =    f"Reference Clock:  {args.refclk / 1e6:.3f} MHz"
-            dcoclk_str =    f"DCO Frequency:   {fDCO / 1e6:.3f} MHz"
-            bit_rate_str =  f"Bit Rate Clock:  {bit_rate_clock / 1e6:.3f} MHz" if bit_rate_clock else "Invalid PLL Config"
-            data_path_str = f"TX Datapath Clock: {data_path_clock / 1e6:.3f} MHz" if data_path_clock else "Invalid Data Path Config"
-
-            txuc = (self.regfile.fields.get("TX_TAIL_CASCODE", {}).get("val", 0) + 10) * (self.regfile.fields.get("TX_AMP", {}).get("val", 0) + 1) * 9.375 # uA
-
-            branch_pre  = self.regfile.fields.get("TX_BRANCH_EN_PRE", {}).get("val", 0x0)
-            brach_main  = self.regfile.fields.get("TX_BRANCH_EN_MAIN", {}).get("val", 0x0)
-            branch_post = self.regfile.fields.get("TX_BRANCH_EN_POST", {}).get("val", 0x0)
-
-            total_number_of_branches = branch_pre + brach_main + branch_post
-            pre_cursor  = self.regfile.fields.get("TX_SEL_PRE", {}).get("val", 0x0)
-            post_cursor = self.regfile.fields.get("TX_SEL_POST", {}).get("val", 0x0)
-            main_cursor = total_number_of_branches - pre_cursor - post_cursor
-
-            vd = total_number_of_branches * txuc * 0.000001 * 50 # Ohm
-            vb = (main_cursor - pre_cursor - post_cursor) * txuc * 0.000001 * 50 # Ohm
-            vc = (main_cursor + pre_cursor - post_cursor) * txuc * 0.000001 * 50 # Ohm
-            va = (main_cursor - pre_cursor + post_cursor) * txuc * 0.000001 * 50 # Ohm
-
-            txuc_str = f"TX Unit Current:      {txuc} uA"
-            txvd_str = f"TX Boost Voltage:     {vd:.3f} V"
-            txvc_str = f"TX Pre-emph. Voltage: {vc:.3f} V"
-            txvb_str = f"TX De-emph. Voltage:  {vb:.3f} V"
-            txva_str = f"TX Signal Voltage:    {va:.3f} V"
-
-            vcm_sel = self.regfile.fields.get("RX_RTERM_VCMSEL", {}).get("val", 0x0)
-            rx_rterm_vcm = args.vcore * (18 + vcm_sel) / 29
+            pll_strs = derived.get(pll_strings, "PLL_MAIN_DIVSEL", "PLL_OUT_DIVSEL", "PLL_FCNTRL", "TX_DATAPATH_SEL")
+            tx_strs = derived.get(tx_strings, *self.TX_VOLTAGE_FIELDS)
+            rx_rterm_vcm_str = derived.get(vcm_string, "RX_RTERM_VCMSEL")
+            rx_data_strs = derived.get(rx_data_strings, "TX_DATAPATH_SEL", *self.RX_DATA_FIELDS)
 
-            rx_rterm_vcm_str = f"RX RTERM VCM:     {rx_rterm_vcm:.3f} V"
+            frame.put(0, 2, " FPGA SerDes Parameters (Auto-Update Enabled) ", curses.A_BOLD | curses.A_REVERSE)
 
-            # Extract RX data
-            word80 = self.regfile.fields.get("RX_DATA[79:64]", {}).get("val", 0x0)
-            word80 = (word80 << 16) | self.regfile.fields.get("RX_DATA[63:48]", {}).get("val", 0x0)
-            word80 = (word80 << 16) | self.regfile.fields.get("RX_DATA[47:32]", {}).get("val", 0x0)
-            word80 = (word80 << 16) | self.regfile.fields.get("RX_DATA[31:16]", {}).get("val", 0x0)
-            word80 = (word80 << 16) | self.regfile.fields.get("RX_DATA[15:0]",  {}).get("val", 0x0)
-            rx_data_80bit_str = f"RX_DATA[79:0]: 0x{word80:0{int(datapath_width/4)}X}"
+            # only rows between the title and the footer are drawn, scrolled to keep the selection visible
+            view_rows = max(1, max_y - 12)
+            selected_row = selected_index % num_rows
+            if selected_row < top_row:
+                top_row = selected_row
+            elif selected_row >= top_row + view_rows:
+                top_row = selected_row - view_rows + 1
+            top_row = max(0, min(top_row, num_rows - view_rows))
 
-            word64 = 0
-            for bit_offset in range(0, 80, 10):
-                word64 |= ((word80 >> bit_offset) & 0xFF) << int((bit_offset * 8)/10)
-            rx_data_64bit_str = f"RX_DATA[63:0]: 0x{word64:016X}"
+            for row in range(top_row, min(num_rows, top_row + view_rows)):
+                for col in range(num_columns):
+                    index = row + col * num_rows
+                    if index >= len(param_list):
+                        continue
 
-            stdscr.clear()
-            stdscr.addstr(0, 2, " FPGA SerDes Parameters (Auto-Update Enabled) ", curses.A_BOLD | curses.A_REVERSE)
+                    name, data = param_list[index]
+                    value = self.value(name)
+                    mode = data.mode  # Get mode (R/W, W/C, R/C, R)
+                    color_pair = ColorFormatter.get_color_pair(name, value)
 
-            with self.param_lock:
-                for row in range(num_rows):
-                    for col in range(num_columns):
-                        index = row + col * num_rows
-                        if index >= len(param_list):
-                            continue
+                    formatted_value = f"0x{value:X}" if show_hex else f"{value}"
 
-                        name, data = param_list[index]
-                        value = data['val']
-                        mode = data['mode']  # Get mode (R/W, W/C, R/C, R)
-                        color_pair = ColorFormatter.get_color_pair(name, value)
+                    # Read-only and Write/Clear (dimmed text)
+                    text_attr = curses.color_pair(color_pair) | curses.A_DIM if mode in ["R", "R/C"] else curses.color_pair(color_pair)
 
-                        formatted_value = f"0x{value:X}" if show_hex else f"{value}"
+                    x_pos = col * col_width + 2
+                    y_pos = row - top_row + 2
 
-                        # Read-only and Write/Clear (dimmed text)
-                        text_attr = curses.color_pair(color_pair) | curses.A_DIM if mode in ["R", "R/C"] else curses.color_pair(color_pair)
-
-                        x_pos = col * col_width + 2
-                        y_pos = row + 2
-
-                        # Highlight selected row
-                        if index == selected_index:
-                            stdscr.addstr(y_pos, x_pos, f"{name:<{max_name_length}} {formatted_value:<8}", curses.A_REVERSE)
-                        else:
-                            # Print parameter name (dimmed for R & W/C)
-                            stdscr.addstr(y_pos, x_pos, f"{name:<{max_name_length}}", text_attr)
+                    # Highlight selected row
+                    if index == selected_index:
+                        frame.put(y_pos, x_pos, f"{name:<{max_name_length}} {formatted_value:<8}", curses.A_REVERSE)
+                    else:
+                        # Print parameter name (dimmed for R & W/C)
+                        frame.put(y_pos, x_pos, f"{name:<{max_name_length}}", text_attr)
 
-                            # Print value in color
-                            stdscr.addstr(y_pos, x_pos + max_name_length + 1, f"{formatted_value:<8}", curses.color_pair(color_pair))
+                        # Print value in color
+                        frame.put(y_pos, x_pos + max_name_length + 1, f"{formatted_value:<8}", curses.color_pair(color_pair))
 
-            stdscr.addstr(max_y - 10, 2, refclk_str)
-            stdscr.addstr(max_y -  9, 2, dcoclk_str)
-            stdscr.addstr(max_y -  8, 2, bit_rate_str)
-            stdscr.addstr(max_y -  7, 2, data_path_str)
-            stdscr.addstr(max_y -  5, 2, rx_data_80bit_str)
-            stdscr.addstr(max_y -  4, 2, rx_data_64bit_str)
+            for (i, line) in enumerate(pll_strs):
+                frame.put(max_y - 10 + i, 2, line)
+            frame.put(max_y -  5, 2, rx_data_strs[0])
+            frame.put(max_y -  4, 2, rx_data_strs[1])
 
-            stdscr.addstr(max_y - 10, 60, txuc_str)
-            stdscr.addstr(max_y -  9, 60, txvd_str)
-            stdscr.addstr(max_y -  8, 60, txvc_str)
-            stdscr.addstr(max_y -  7, 60, txvb_str)
-            stdscr.addstr(max_y -  6, 60, txva_str)
+            for (i, line) in enumerate(tx_strs):
+                frame.put(max_y - 10 + i, 60, line)
 
-            stdscr.addstr(max_y - 10, 100, rx_rterm_vcm_str)
+            frame.put(max_y - 10, 100, rx_rterm_vcm_str)
+            if self.stats is not None:
+                frame.put(max_y - 3, 2, self.stats.status_line())
 
             search_hint = "[n] Next match  |  " if search_results else ""
-            stdscr.addstr(max_y - 2, 2, f"{search_hint}[Arrow Keys] Navigate | [Enter] Edit | [/] Find | [h] Toggle HEX/DEC | [q] Quit", curses.A_BOLD)
+            frame.put(max_y - 2, 2, f"{search_hint}[Arrow Keys] Navigate | [Enter] Edit | [/] Find | [h] Toggle HEX/DEC | [q] Quit", curses.A_BOLD)
 
-            stdscr.refresh()
+            frame.commit()
 
-            try:
-                key = stdscr.getch()
-            except curses.error:
-                key = -1  # No input
+            # only redraw on new data or a keypress
+            key = -1
+            while key == -1 and drawn == self._updates:
+                try:
+                    key = stdscr.getch()
+                except curses.error:
+                    key = -1  # No input
 
             if key == ord("h") or key == ord("d"):
                 show_hex = not show_hex
@@ -1477,12 +3340,14 @@ class SerdesTool:
             elif key == curses.KEY_RIGHT and selected_index + num_rows < len(param_list):
                 selected_index += num_rows
             elif key == ord("\n"):
-                if param_list[selected_index][1]['mode'] in ["R", "R/C"]:
+                if param_list[selected_index][1].mode in ["R", "R/C"]:
                     self.error_message(stdscr, "Cannot edit read-only parameter!")
                 else:
                     self.edit_value_popup(stdscr, param_list[selected_index])
+                frame.invalidate()
             elif key == ord("/"):
                 search_results, search_index = self.find_parameter(stdscr, param_list)
+                frame.invalidate()
                 if search_results:
                     selected_index = search_results[search_index]
             elif key == ord("n") and search_results:
@@ -1502,46 +3367,30 @@ class SerdesTool:
                 self.push_dec(param_list[selected_index])
             elif key == ord("p"):
                 self.push_dec([None, self.regfile.fields["PLL_EN_ADPLL_CTRL"]])
+            elif key == curses.KEY_RESIZE:
+                frame.invalidate()
             elif key == ord("q"):
                 break
 
     def push_button(self, field, val=1):
-        hbit, lbit = field['hbit'], field['lbit']
-        mask = ((1 << (hbit - lbit + 1)) - 1) << lbit
-        addr = field['addr']
-        self._tool.wr_serdes_regfile(idx=args.idx, addr=addr, data=int(val) << lbit, mask=mask, wren=1)
-        self._tool.rd_serdes_regfile(idx=args.idx)
+        self.submit(self.wr_regfile, idx=args.idx, addr=field.addr, data=field.encode(val), mask=field.mask, priority=CableScheduler.USER)
 
     def push_inc(self, param):
         name, data = param
-
-        hbit, lbit = data['hbit'], data['lbit']
-        mask = ((1 << (hbit - lbit + 1)) - 1) << lbit
-        addr = data['addr']
-
-        self._tool.wr_serdes_regfile(idx=args.idx, addr=addr, data=int(data['val'])+1 << lbit, mask=mask, wren=1)
-        self._tool.rd_serdes_regfile(idx=args.idx)
+        self.push_button(data, self.value(data.name)+1)
 
     def push_dec(self, param):
         name, data = param
-
-        hbit, lbit = data['hbit'], data['lbit']
-        mask = ((1 << (hbit - lbit + 1)) - 1) << lbit
-        addr = data['addr']
-
-        self._tool.wr_serdes_regfile(idx=args.idx, addr=addr, data=int(data['val'])-1 << lbit, mask=mask, wren=1)
-        self._tool.rd_serdes_regfile(idx=args.idx)
+        self.push_button(data, self.value(data.name)-1)
 
     def edit_value_popup(self, stdscr, param):
         name, data = param
         max_y, max_x = stdscr.getmaxyx()
 
         # Calculate the valid range from `hbit` and `lbit`
-        hbit, lbit = data['hbit'], data['lbit']
-        mask = ((1 << (hbit - lbit + 1)) - 1) << lbit
-        addr = data['addr']
+        lbit, mask, addr = data.lbit, data.mask, data.addr
         min_value = 0
-        max_value = (1 << (hbit - lbit + 1)) - 1  # Compute max based on bit range
+        max_value = data.max  # Compute max based on bit range
 
         win_height, win_width = 9, 50
         start_y = (max_y - win_height) // 2
@@ -1551,7 +3400,7 @@ class SerdesTool:
         win.box()
         win.addstr(1, 2, f"Editing:  {name}", curses.A_BOLD)
         win.addstr(2, 2, f"Position: addr=0x{addr:02X} mask=0x{mask:04X}")
-        win.addstr(3, 2, f"Current:  {data['val']}  (Range: {min_value} - {max_value})")  # Show valid range
+        win.addstr(3, 2, f"Current:  {self.value(name)}  (Range: {min_value} - {max_value})")  # Show valid range
         win.addstr(5, 2, "New value: ")
         win.addstr(7, 2, "[Enter] Save  |  [ESC/q] Cancel", curses.A_DIM)
 
@@ -1571,10 +3420,8 @@ class SerdesTool:
                 try:
                     entered_value = int(new_val, 0)  # Convert input to integer
                     if min_value <= entered_value <= max_value:
-                        with self.param_lock:
-                            #data['val'] = entered_value  # Apply change if within range
-                            self._tool.wr_serdes_regfile(idx=args.idx, addr=addr, data=entered_value << lbit, mask=mask, wren=1)
-                            self._tool.rd_serdes_regfile(idx=args.idx)
+                        #data.val = entered_value  # Apply change if within range
+                        self.submit(self.wr_regfile, idx=args.idx, addr=addr, data=entered_value << lbit, mask=mask, priority=CableScheduler.USER)
                         break
                     else:
                         win.addstr(6, 2, "Out of range! Try again.", curses.A_BOLD | curses.color_pair(3))
@@ -1662,29 +3509,354 @@ class SerdesTool:
         del win
 
 
+class BenchScreen:
+    """stdscr for draw_parameters that presses 'h' every frame and 'q' once enough frames are drawn."""
+
+    def __init__(self, stdscr, until):
+        self.stdscr = stdscr
+        self.until = until
+        self.times = []
+
+    def __getattr__(self, name):
+        return getattr(self.stdscr, name)
+
+    def getch(self):
+        self.times.append(perf_counter())
+        return ord('q') if perf_counter() >= self.until and len(self.times) > SerdesBench.MIN_OPS else ord('h')
+
+class SerdesBench:
+    """Times the host-side hot paths of a SerdesTool.
+
+    Every case runs for at least duration seconds and MIN_OPS ops. Percentiles
+    are taken over the wall time of single ops; USB transfers are the round
+    trips JtagStats counts. A case that cannot run on this board returns the
+    reason it is skipped.
+    """
+    VERSION = 2 # usb/op counts round trips since version 2
+    MIN_OPS = 5
+    PERCENTILES = (50, 90, 99)
+    CFG_BYTES = 1 << 20 # order of an uncompressed bitstream
+    CASES = ('rd_regfile', 'update_values', 'wr_regfile_tx_data', 'rd_regfile_rx_data',
+             'wr_cfg', 'read_cfg_parse', 'read_cfg_cached', 'draw_parameters')
+
+    def __init__(self, serdes, idx, duration=1.0, cfg=None):
+        self.serdes = serdes
+        self.idx = idx
+        self.duration = duration
+        self.cfg = cfg
+        self.rng = random.Random(0)
+        self.transfers = 0
+        self.stats = None # JtagStats for counting without --stats
+
+    @contextmanager
+    def counting(self):
+        """Counts USB round trips into self.transfers while active."""
+        tool = self.serdes._tool
+        stats = tool.stats
+        if stats is None:
+            # a JtagStats of our own, detached again so it does not slow down the other cases
+            stats = self.stats = self.stats or JtagStats(tool, ArgHzParse(args.freq), callers=False)
+            tool.stats = stats
+        start = stats.totals['usb'][0]
+        try:
+            yield
+        finally:
+            self.transfers += stats.totals['usb'][0] - start
+            if stats is self.stats:
+                tool.stats = None
+
+    def summary(self, times, transfers) -> dict:
+        total = sum(times)
+        result = {'ops': len(times), 'ops_per_s': len(times) / total if total else 0.0,
+                  'usb_per_op': transfers / len(times)}
+        for (p, t) in zip(self.PERCENTILES, np.percentile(times, self.PERCENTILES)):
+            result[f'p{p}'] = float(t)
+        return result
+
+    def time_ops(self, op, setup=None) -> dict:
+        """Runs op until duration is spent, setup before each op is not timed."""
+        times = []
+        self.transfers = 0
+        until = perf_counter() + self.duration
+        while perf_counter() < until or len(times) < self.MIN_OPS:
+            if setup is not None:
+                setup()
+            with self.counting():
+                start = perf_counter()
+                op()
+                times.append(perf_counter() - start)
+        return self.summary(times, self.transfers)
+
+    def bench_rd_regfile(self):
+        s = self.serdes
+        return self.time_ops(lambda: s.rd_regfile(self.idx, 0x02), setup=lambda: s.invalidate(self.idx, 0x02))
+
+    def bench_update_values(self):
+        # one tick of update_values: volatile words from the cable, configuration from the shadow
+        addrs = chain(range(0x00, 0x30), range(0x30, 0x43), range(0x50, 0x5D))
+        poller = SerdesPoller(self.serdes, self.idx, addrs, ArgHzParse(args.freq))
+        return self.time_ops(lambda: poller.poll(None).freeze())
+
+    def bench_wr_regfile_tx_data(self):
+        return self.time_ops(lambda: self.serdes.wr_regfile_tx_data(self.rng.getrandbits(80)))
+
+    def bench_rd_regfile_rx_data(self):
+        return self.time_ops(self.serdes.rd_regfile_rx_data)
+
+    def bench_wr_cfg(self):
+        # the sim takes the bitstream in one call, only the FTDI streaming loop is worth timing
+        if not self.serdes._tool._mpsse:
+            return 'hardware only'
+        if self.cfg is None:
+            return 'needs --cfg' # don't load a random bitstream into a real FPGA
+        data = ReadCfgFile(self.cfg)
+        def op():
+            with redirect_stdout(io.StringIO()):
+                self.serdes._tool.wr_cfg(data, self.idx)
+        result = self.time_ops(op)
+        self.serdes.invalidate(self.idx)
+        result['bytes'] = len(data)
+        return result
+
+    def write_cfg_text(self, filename):
+        with open(filename, 'w') as f:
+            f.write('// serdestool benchmark\n')
+            data = self.rng.randbytes(self.CFG_BYTES)
+            for pos in range(0, len(data), 16):
+                f.write(data[pos:pos+16].hex() + '\n')
+
+    def bench_read_cfg_parse(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'bench.cfg')
+            self.write_cfg_text(filename)
+            def drop_sidecars():
+                for sidecar in glob.glob(filename + '.*.bin'):
+                    os.remove(sidecar)
+            return self.time_ops(lambda: ReadCfgFile(filename), setup=drop_sidecars)
+
+    def bench_read_cfg_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'bench.cfg')
+            self.write_cfg_text(filename)
+            ReadCfgFile(filename)
+            return self.time_ops(lambda: ReadCfgFile(filename))
+
+    def bench_draw_parameters(self):
+        if not (sys.stdin.isatty() and sys.stdout.isatty()):
+            return 'needs a terminal'
+        screens = []
+        def draw(stdscr):
+            screens.append(BenchScreen(stdscr, perf_counter() + self.duration))
+            self.serdes.draw_parameters(screens[0])
+        try:
+            curses.wrapper(draw)
+        except curses.error as e:
+            return f'curses failed: {e}'
+        finally:
+            signal.signal(signal.SIGWINCH, signal.SIG_DFL)
+        # one frame per getch, the first frame includes the curses setup
+        times = list(np.diff(screens[0].times[1:]))
+        return self.summary(times, 0)
+
+    def run(self, cases=None) -> dict:
+        results = {}
+        for name in cases or self.CASES:
+            result = getattr(self, f'bench_{name}')()
+            if isinstance(result, str):
+                print(f'INFO:  {name:20} skipped, {result}')
+                continue
+            results[name] = result
+            print(f'INFO:  {name:20} {result["ops_per_s"]:10.1f} ops/s {result["usb_per_op"]:8.1f} usb/op ' +
+                  ' '.join(f'p{p} {1e6 * result[f"p{p}"]:10.1f} us' for p in self.PERCENTILES))
+        return results
+
+def RunBench(s, args) -> int:
+    """Runs the benchmark, saves it and compares it against a baseline."""
+    cases = args.benchcase or None
+    unknown = set(cases or ()) - set(SerdesBench.CASES)
+    if unknown:
+        print(f'ERROR: Unknown benchmark case {", ".join(sorted(unknown))}, choose from {", ".join(SerdesBench.CASES)}')
+        return 1
+    print(f'INFO:  Benchmarking board {args.board} at {args.freq}Hz, {args.benchtime:g} s per case')
+    results = SerdesBench(s, args.idx, duration=args.benchtime, cfg=args.cfg).run(cases)
+    report = {'version': SerdesBench.VERSION, 'board': args.board, 'freq': args.freq,
+              'date': datetime.datetime.now().isoformat(timespec='seconds'), 'cases': results}
+    if args.benchsave:
+        with open(args.benchsave + '.tmp', 'w') as f:
+            json.dump(report, f, indent=1)
+        os.replace(args.benchsave + '.tmp', args.benchsave)
+        print(f'INFO:  Saved benchmark to {args.benchsave}')
+    if not args.benchbaseline:
+        return 0
+    try:
+        with open(args.benchbaseline) as f:
+            baseline = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f'ERROR: Cannot read benchmark baseline {args.benchbaseline}: {e}')
+        return 1
+    if (baseline.get('board'), baseline.get('freq')) != (args.board, args.freq):
+        print(f'INFO:  Baseline was taken on board {baseline.get("board")} at {baseline.get("freq")}Hz')
+    # usb/op counted something else before the current version
+    same_usb = baseline.get('version') == SerdesBench.VERSION
+    if not same_usb:
+        print(f'INFO:  Baseline is from benchmark version {baseline.get("version")}, not comparing usb/op')
+    regressions = 0
+    for (name, result) in results.items():
+        old = baseline.get('cases', {}).get(name)
+        if old is None:
+            continue
+        speed = result['ops_per_s'] / old['ops_per_s'] if old['ops_per_s'] else 1.0
+        slower = speed < 1 - args.benchtolerance
+        chattier = same_usb and result['usb_per_op'] > old['usb_per_op'] * (1 + args.benchtolerance)
+        regressions += slower or chattier
+        print((bcolors.FAIL if slower or chattier else bcolors.OK) +
+              f'{name:20} {speed:6.2f}x ops/s, usb/op {old["usb_per_op"]:.1f} -> {result["usb_per_op"]:.1f}' + bcolors.RESET)
+    if regressions:
+        print(f'ERROR: {regressions} benchmark case{"s" if regressions > 1 else ""} regressed against {args.benchbaseline}')
+    return 1 if regressions else 0
+
+def RunTestcases(s):
+    if args.tcprbs:
+        s.tc_prbs(force_err=True)
+    if args.tcloopback:
+        s.tc_loopback()
+    if args.tcuipattern is not None:
+        s.tc_uipattern(int(args.tcuipattern))
+    if args.tceyemeas:
+        s.tc_eyemeas(axes=args.sweep, dwell=args.dwell, checkpoint=args.checkpoint)
+    if args.tctxopt:
+        s.tc_txopt(dwell=args.dwell, budget=args.txbudget, min_swing=args.txminswing)
+    if args.rdregrx:
+        s.rd_regfile_rx(verbose=2)
+    if args.rdregrxdata:
+        s.print_regfile_rx_data(verbose=2)
+    if args.rdregtx:
+        s.rd_regfile_tx(verbose=2)
+    if args.rdregpll:
+        s.rd_regfile_pll(verbose=2)
+    if args.rdstatuspll:
+        [s._tool.rd_status_pll(pll=i, verbose=1) for i in range(4)]
+    if s.wait_times:
+        s.print_wait_times()
+
+def PrintStoreQuery(args) -> int:
+    """Prints the BER per value of a regfile field from a result store."""
+    try:
+        store = ResultStore(args.store, SerdesTool.regfile, readonly=True)
+    except (OSError, ValueError) as e:
+        print(f'ERROR: Cannot open result store {args.store}: {e}')
+        return 1
+    if args.query not in store.regfile.fields:
+        print(f'ERROR: Unknown regfile field {args.query}')
+        return 1
+    print(f'INFO:  {store.rows} rows in {args.store}')
+    print(f'{args.query:>24} {"errors":>12} {"bits":>12} {"BER":>10}')
+    for (value, (errors, bits)) in sorted(store.ber_by(args.query, device=args.querydev).items()):
+        print(f'{value:24} {errors:12} {bits:12.3e} {errors / bits:10.3e}')
+    return 0
+
+def RunBoard(board_args) -> dict:
+    """Runs the selected testcases on one board, in a worker process.
+
+    Workers are spawned, so they inherit nothing from the parent: board_args
+    is the worker's own copy of the command line and becomes its module args.
+    """
+    global args
+    args = board_args
+    log = io.StringIO()
+    start = monotonic()
+    with redirect_stdout(log):
+        try:
+            jtag = JtagEngine(frequency=ArgHzParse(args.freq))
+            with SerdesTool(args, jtag, hwinit=True) as s:
+                if args.cfg:
+                    s.wr_cfg(ReadCfgFile(args.cfg), force=args.forcecfg)
+                RunTestcases(s)
+        except Exception as e:
+            print(f'ERROR: {e}')
+    log = log.getvalue()
+    errors = sum(line.startswith('ERROR:') for line in log.splitlines())
+    return {'serial': args.serial, 'log': log, 'errors': errors, 'time': monotonic() - start}
+
+def RunBoards(args, serials) -> int:
+    """Runs the testcases on every board in parallel and prints one merged report."""
+    if not serials:
+        print('ERROR: No FTDI device with a serial number found.')
+        return 1
+    print(f'INFO:  Running on {len(serials)} board{"s" if len(serials) > 1 else ""}: {", ".join(serials)}')
+    # one result store per board, the store has a single writer
+    boards = [argparse.Namespace(**{**vars(args), 'serial': serial, 'store': args.store and f'{args.store}-{serial}'}) for serial in serials]
+    # spawn on every OS, forking a parent with threads is unsafe
+    with ProcessPoolExecutor(max_workers=len(boards), mp_context=multiprocessing.get_context('spawn')) as pool:
+        results = list(pool.map(RunBoard, boards))
+    for r in results:
+        print(f'INFO:  ---- Board {r["serial"]} ----')
+        print(r['log'], end='')
+    print(f'INFO:  ---- Summary ----')
+    for r in results:
+        color = bcolors.FAIL if r['errors'] else bcolors.OK
+        print(color + f'{r["serial"]:24} {"FAIL" if r["errors"] else "PASS"} {r["errors"]:4} errors {r["time"]:8.1f} s' + bcolors.RESET)
+    return 1 if any(r['errors'] for r in results) else 0
+
+def ArgParser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog='serdestool', description='', epilog=ArgEpilog)
+
+    p.add_argument('-l', '--list', dest='listdev', action='store_true', help='list available boards/programmers and exit')
+    p.add_argument('-b', dest='board', type=str, metavar=Boards_e, default=Boards_e[0], required=False, help='select board (default: %(default)s)')
+    p.add_argument('--serial', dest='serial', type=str, required=False, help='FTDI serial number; a comma separated list runs the testcases on all of these boards in parallel')
+    p.add_argument('--all-boards', dest='allboards', action='store_true', help='run the testcases on every connected FT2232H/FT232H in parallel')
+    p.add_argument('--sim-devices', dest='simdevices', type=int, default=1, help='sim board: number of devices in the JTAG chain (default: %(default)s)')
+    p.add_argument('--sim-latency', dest='simlatency', type=float, default=0.0, help='sim board: seconds of USB latency per cable round trip, 0 runs without delay (default: %(default)s)')
+    p.add_argument('--sim-ber', dest='simber', type=float, default=1e-12, help='sim board: PRBS bit error rate at the optimal TX/RX settings (default: %(default)s)')
+    p.add_argument('--sim-lock-delay', dest='simlockdelay', type=float, default=0.01, help='sim board: seconds until the ADPLL locks (default: %(default)s)')
+    p.add_argument('--index-chain', dest='idx', type=int, default=0, required=False, help='device index in JTAG chain (default: %(default)s)')
+    p.add_argument('--broadcast', dest='broadcast', type=ArgIdxList, default=[], metavar='IDX[,IDX...]', required=False, help='mirror every regfile write to these chain positions in the same scan')
+    p.add_argument('--freq', type=ArgHzRegex, default='20M', metavar="[0 - 30M]", required=False, help='frequency setting; append "k" to the argument for kilohertz or "M" for megahertz (default: %(default)s)')
+    p.add_argument('-m', dest='genmod', type=str, required=False, help='generate verilog or vhdl module and exit; specify the file format with extension .v or .vhd')
+    p.add_argument('--refclk', dest='refclk', type=float, default=100e6, help='serdes reference clock frequency (default: %(default)s)')
+    p.add_argument('--vcore', dest='vcore', type=float, default=1.1, help='core voltage (default: %(default)s)')
+    p.add_argument('--cfg', dest='cfg', type=str, required=False, help='configure the FPGA with this bitstream (.bit, .bin or .cfg) unless serdestool already loaded it, see --force')
+    p.add_argument('--force', '--force-cfg', dest='forcecfg', action='store_true', help='configure even if the bitstream looks loaded; needed after programming the FPGA with another tool, which the skip check cannot see')
+    p.add_argument('--rdregrx', dest='rdregrx', action='store_true', help='read rx regfile')
+    p.add_argument('--rdregrxdata', dest='rdregrxdata', action='store_true', help='read rx data')
+    p.add_argument('--rdregtx', dest='rdregtx', action='store_true', help='read tx regfile')
+    p.add_argument('--rdregpll', dest='rdregpll', action='store_true', help='read pll regfile')
+    p.add_argument('--rdstatuspll', dest='rdstatuspll', action='store_true', help='read pll status registers')
+    p.add_argument('--verify', dest='verify', action='store_true', help='read back posted regfile writes once per sequence and report mismatches')
+    p.add_argument('--verify-shadow', dest='verifyshadow', action='store_true', help='read the hardware on every cached regfile read and report shadow mismatches')
+    p.add_argument('--readback', dest='readback', action='store_true', help='read back every regfile write instead of posting it')
+    p.add_argument('--gui', dest='gui', action='store_true', help='start curses gui')
+    p.add_argument('--record', dest='record', type=str, default=None, metavar='FILE', help='record regfile snapshots to a compressed binary log instead of starting the gui')
+    p.add_argument('--record-interval', dest='recordinterval', type=float, default=0.0, help='record: seconds between status polls, 0 polls as fast as the cable allows (default: %(default)s)')
+    p.add_argument('--record-time', dest='recordtime', type=float, default=None, help='record: stop after this many seconds (default: until Ctrl-C)')
+    p.add_argument('--tcprbs', dest='tcprbs', action='store_true', help='testcase: prbs')
+    p.add_argument('--ber', dest='ber', type=float, default=1e-9, help='prbs testcase: target bit error rate (default: %(default)s)')
+    p.add_argument('--ber-cl', dest='bercl', type=float, default=0.95, help='prbs testcase: confidence level of the BER verdict (default: %(default)s)')
+    p.add_argument('--ber-time', dest='bertime', type=float, default=10.0, help='prbs testcase: maximum seconds per polynomial (default: %(default)s)')
+    p.add_argument('--tcloopback', dest='tcloopback', action='store_true', help='testcase: loopback')
+    p.add_argument('--tceyemeas', dest='tceyemeas', action='store_true', help='testcase: PRBS error sweep over RX equalizer and TX driver settings')
+    p.add_argument('--sweep', dest='sweep', type=ArgSweep, action='append', metavar='FIELD=START:STOP[:STEP]', help='eye testcase: sweep this field, may be repeated (default: RX_EQA_CKP_LF and RX_EQA_CKP_HF in steps of 32)')
+    p.add_argument('--dwell', dest='dwell', type=float, default=0.1, help='eye and tx testcases: seconds of PRBS error counting per point (default: %(default)s)')
+    p.add_argument('--checkpoint', dest='checkpoint', type=str, default=None, help='eye testcase: save progress to this json file and resume from it')
+    p.add_argument('--tctxopt', dest='tctxopt', action='store_true', help='testcase: search TX_SEL_PRE/TX_SEL_POST/TX_AMP for the lowest PRBS error rate')
+    p.add_argument('--tx-budget', dest='txbudget', type=int, default=64, help='tx optimizer: maximum number of dwell windows (default: %(default)s)')
+    p.add_argument('--tx-min-swing', dest='txminswing', type=float, default=0.2, help='tx optimizer: minimum modeled signal voltage Va in V (default: %(default)s)')
+    p.add_argument('--store', dest='store', type=str, default=None, help='append every PRBS error count with the regfile words of its device to this result store directory')
+    p.add_argument('--query', dest='query', type=str, default=None, metavar='FIELD', help='print BER vs FIELD from the --store results and exit')
+    p.add_argument('--query-device', dest='querydev', type=int, default=None, metavar='IDX', help='restrict --query to this chain position')
+    p.add_argument('--stats', dest='stats', action='store_true', help='count JTAG scans, bits and USB transfers per caller and print a summary at exit')
+    p.add_argument('--bench', dest='bench', action='store_true', help='benchmark the host-side hot paths and exit')
+    p.add_argument('--bench-case', dest='benchcase', type=str, action='append', metavar='NAME', help=f'benchmark only this case, may be repeated ({", ".join(SerdesBench.CASES)})')
+    p.add_argument('--bench-time', dest='benchtime', type=float, default=1.0, help='benchmark: seconds per case (default: %(default)s)')
+    p.add_argument('--bench-save', dest='benchsave', type=str, default=None, metavar='FILE', help='benchmark: save the results to this json baseline')
+    p.add_argument('--bench-baseline', dest='benchbaseline', type=str, default=None, metavar='FILE', help='benchmark: fail if a case is slower or needs more USB transfers than in this json baseline')
+    p.add_argument('--bench-tolerance', dest='benchtolerance', type=float, default=0.2, help='benchmark: allowed relative regression against the baseline (default: %(default)s)')
+    p.add_argument('--tcuipattern', dest='tcuipattern', choices=['0','2','20','40','80'], default=None, required=False, help='testcase: 2,20,40,80 UI square wave pattern')
+    return p
+
 if __name__ == '__main__':
     try:
-        p = argparse.ArgumentParser(prog='serdestool', description='', epilog=ArgEpilog)
-
-        p.add_argument('-l', '--list', dest='listdev', action='store_true', help='list available boards/programmers and exit')
-        p.add_argument('-b', dest='board', type=str, metavar=Boards_e, default=Boards_e[0], required=False, help='select board (default: %(default)s)')
-        p.add_argument('--serial', dest='serial', type=str, required=False, help='FTDI serial number')
-        p.add_argument('--index-chain', dest='idx', type=int, default=0, required=False, help='device index in JTAG chain (default: %(default)s)')
-        p.add_argument('--freq', type=ArgHzRegex, default='20M', metavar="[0 - 30M]", required=False, help='frequency setting; append "k" to the argument for kilohertz or "M" for megahertz (default: %(default)s)')
-        p.add_argument('-m', dest='genmod', type=str, required=False, help='generate verilog or vhdl module and exit; specify the file format with extension .v or .vhd')
-        p.add_argument('--refclk', dest='refclk', type=float, default=100e6, help='serdes reference clock frequency (default: %(default)s)')
-        p.add_argument('--vcore', dest='vcore', type=float, default=1.1, help='core voltage (default: %(default)s)')
-        p.add_argument('--rdregrx', dest='rdregrx', action='store_true', help='read rx regfile')
-        p.add_argument('--rdregrxdata', dest='rdregrxdata', action='store_true', help='read rx data')
-        p.add_argument('--rdregtx', dest='rdregtx', action='store_true', help='read tx regfile')
-        p.add_argument('--rdregpll', dest='rdregpll', action='store_true', help='read pll regfile')
-        p.add_argument('--rdstatuspll', dest='rdstatuspll', action='store_true', help='read pll status registers')
-        p.add_argument('--gui', dest='gui', action='store_true', help='start curses gui')
-        p.add_argument('--tcprbs', dest='tcprbs', action='store_true', help='testcase: prbs')
-        p.add_argument('--tcloopback', dest='tcloopback', action='store_true', help='testcase: loopback')
-        p.add_argument('--tcuipattern', dest='tcuipattern', choices=['0','2','20','40','80'], default=None, required=False, help='testcase: 2,20,40,80 UI square wave pattern')
-
-        args = p.parse_args()
+        args = ArgParser().parse_args()
         usb  = UsbTools()
         jtag = JtagEngine(frequency=ArgHzParse(args.freq))
 
@@ -1696,6 +3868,13 @@ if __name__ == '__main__':
                 print(*line)
             sys.exit()
 
+        if args.query:
+            sys.exit(PrintStoreQuery(args))
+
+        serials = FindFtdiSerials() if args.allboards else args.serial.split(',') if args.serial else []
+        if args.allboards or len(serials) > 1:
+            sys.exit(RunBoards(args, serials))
+
         with SerdesTool(args, jtag, hwinit=not args.genmod) as s:
             if args.genmod is not None:
                 filename = args.genmod.lower()
@@ -1705,27 +3884,29 @@ if __name__ == '__main__':
                     s.gen_module_vhdl(filename)
                 sys.exit()
 
-            if args.gui:
-                update_thread = threading.Thread(target=s.update_values, daemon=True)
+            if args.bench:
+                sys.exit(RunBench(s, args))
+
+            if args.cfg:
+                s.wr_cfg(ReadCfgFile(args.cfg), force=args.forcecfg)
+
+            if args.record:
+                s.record_telemetry(args.record, interval=args.recordinterval, duration=args.recordtime)
+            elif args.gui:
+                s.scheduler = CableScheduler()
+                s.scheduler.start()
+                stop = threading.Event()
+                update_thread = threading.Thread(target=s.update_values, kwargs={'stop': stop}, daemon=True)
                 update_thread.start()
-                curses.wrapper(s.draw_parameters)
+                try:
+                    curses.wrapper(s.draw_parameters)
+                finally:
+                    # the poller goes through the scheduler, so it has to end first
+                    stop.set()
+                    update_thread.join()
+                    s.scheduler.stop()
             else:
-                if args.tcprbs:
-                    s.tc_prbs(force_err=True)
-                if args.tcloopback:
-                    s.tc_loopback()
-                if args.tcuipattern is not None:
-                    s.tc_uipattern(int(args.tcuipattern))
-                if args.rdregrx:
-                    s.rd_regfile_rx(verbose=2)
-                if args.rdregrxdata:
-                    s.print_regfile_rx_data(verbose=2)
-                if args.rdregtx:
-                    s.rd_regfile_tx(verbose=2)
-                if args.rdregpll:
-                    s.rd_regfile_pll(verbose=2)
-                if args.rdstatuspll:
-                    [s._tool.rd_status_pll(pll=i, verbose=1) for i in range(4)]
+                RunTestcases(s)
 
     except Exception as e:
         print(e)
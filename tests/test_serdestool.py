@@ -0,0 +1,381 @@
+#
+#  serdestool regression tests against the simulated '-b sim' board
+#
+#  run with: python3 -m pytest tests
+#
+
+import os
+import sys
+import contextlib
+import io
+import math
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import serdestool as st
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    """Returns a function that builds a SerdesTool on the sim board from command line arguments."""
+    monkeypatch.setattr(st.CfgDatabase, 'path', str(tmp_path / 'configured'))
+    tools = []
+    def make(*argv):
+        st.args = st.ArgParser().parse_args(['-b', 'sim', *argv])
+        with contextlib.redirect_stdout(io.StringIO()):
+            s = st.SerdesTool(st.args, st.JtagEngine(frequency=st.ArgHzParse(st.args.freq)), hwinit=True)
+        tools.append(s)
+        return s
+    yield make
+    for s in tools:
+        with contextlib.redirect_stdout(io.StringIO()):
+            s.__exit__(None, None, None)
+
+def run(fn, *a, **kw):
+    """Calls fn and returns its result and what it printed."""
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        result = fn(*a, **kw)
+    return result, out.getvalue()
+
+def test_deferred_reads(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    old = dev.words[0x31]
+    trips = s._jtag.round_trips
+    with s.sequence():
+        (word,) = s.rd_regfile_burst(0, [0x31], deferred=True)
+        s.wr_regfile(0, 0x31, old ^ 0x0001, 0x0001) # must not flush for the queued read
+        assert not word.done()
+        assert s._jtag.round_trips == trips
+    assert s._jtag.round_trips == trips + 1
+    assert int(word.result()) == old
+    assert s.shadow_word(0, 0x31) & 0x0001 == (old ^ 0x0001) & 0x0001
+
+def test_posted_writes(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    writes = ((0x30, 0x0123), (0x31, 0x0456), (0x32, 0x0007))
+    trips = s._jtag.round_trips
+    with s.sequence():
+        for (addr, data) in writes:
+            s.wr_regfile(0, addr, data, 0xFFFF)
+    assert s._jtag.round_trips - trips == 1 # one flush for the whole sequence
+    assert [dev.words[addr] for (addr, data) in writes] == [data & dev.writable[addr] for (addr, data) in writes]
+
+def test_posted_writes_verify(sim):
+    s = sim('--verify')
+    dev = s._jtag.devices[0]
+    dev.writable[0x31] &= ~0x0001 # a bit the device does not take
+    def writes():
+        with s.sequence():
+            s.wr_regfile(0, 0x30, 0x0123, 0xFFFF)
+            s.wr_regfile(0, 0x31, 0x0455, 0xFFFF)
+    result, out = run(writes)
+    assert out.count('ERROR') == 1 and 'failed at 0x31' in out
+    assert 'ERROR' not in run(s.wr_regfile, 0, 0x30, 0x0124, 0xFFFF)[1]
+
+def test_shadow_reads(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    word = s.rd_regfile(0, 0x31)
+    trips = s._jtag.round_trips
+    assert int(s.rd_regfile(0, 0x31)) == int(word) == dev.words[0x31]
+    assert s._jtag.round_trips == trips # served from the shadow
+    s.invalidate(0, 0x31)
+    s.rd_regfile(0, 0x31)
+    assert s._jtag.round_trips == trips + 1
+    # volatile words always come from the device
+    s.rd_regfile(0, 0x1F)
+    s.rd_regfile(0, 0x1F)
+    assert s._jtag.round_trips == trips + 3
+
+def test_checks_read_hardware(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    dev.writable[0x40] &= ~0x01C0 # TX_PRBS_SEL does not take the write
+    result, out = run(s.tc_uipattern, 2)
+    assert 'ERROR: TX PRBS mode is invalid' in out
+
+def test_verify_shadow(sim):
+    s = sim('--verify-shadow')
+    dev = s._jtag.devices[0]
+    s.rd_regfile(0, 0x31)
+    dev.words[0x31] ^= 0x0001 # changed behind the shadow
+    word, out = run(s.rd_regfile, 0, 0x31)
+    assert 'ERROR: Shadow mismatch at 0x31' in out
+    assert int(word) == dev.words[0x31]
+
+def test_poller_volatile_words(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    poller = st.SerdesPoller(s, 0, range(s.REGFILE_SIZE), 20e6)
+    prev = poller.poll()
+    trips = s._jtag.round_trips
+    for addr in (0x1D, 0x31):
+        dev.words[addr] ^= 0x0001 # 0x1D is volatile, 0x31 configuration
+    snap = poller.poll(prev)
+    assert snap.words[0x1D] == dev.words[0x1D]
+    assert snap.words[0x31] == prev.words[0x31] # from the shadow
+    assert s._jtag.round_trips - trips == math.ceil(len(poller.fast) / poller.CHUNK)
+
+def test_scheduler_shared_shadow(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    s.scheduler = st.CableScheduler()
+    s.scheduler.start()
+    stop = threading.Event()
+    poller = threading.Thread(target=s.update_values, kwargs={'stop': stop})
+    poller.start()
+    try:
+        for value in range(200):
+            s.submit(s.wr_regfile, idx=0, addr=0x31, data=value, mask=0x001F, priority=st.CableScheduler.USER)
+    finally:
+        stop.set()
+        poller.join()
+        s.scheduler.stop()
+    s.scheduler = None
+    assert s.shadow_word(0, 0x31) == dev.words[0x31]
+    assert dev.words[0x31] & 0x001F == 199 & 0x001F & dev.writable[0x31]
+
+@pytest.mark.parametrize('idx', [0, 1, 2])
+def test_chain_position(sim, idx):
+    s = sim('--sim-devices', '3', '--index-chain', str(idx))
+    devices = s._jtag.devices
+    s.wr_regfile(idx, 0x30, 0x0A5A, 0xFFFF)
+    for (d, dev) in enumerate(devices):
+        expected = 0x0A5A & dev.writable[0x30] if d == idx else devices[(idx + 1) % 3].words[0x30]
+        assert dev.words[0x30] == expected
+    s.invalidate()
+    assert int(s.rd_regfile(idx, 0x30)) == devices[idx].words[0x30]
+    assert len(s.rd_regfile(idx, 0x30)) == 16
+
+def test_broadcast(sim):
+    s = sim('--sim-devices', '3', '--broadcast', '2')
+    devices = s._jtag.devices
+    s.wr_regfile(0, 0x30, 0x0A5A, 0xFFFF)
+    assert [dev.words[0x30] for dev in devices] == [0x0A5A & devices[0].writable[0x30], devices[1].words[0x30], 0x0A5A & devices[2].writable[0x30]]
+    assert devices[1].words[0x30] != devices[0].words[0x30]
+    # the mirrored device is known to the shadow as well
+    trips = s._jtag.round_trips
+    assert int(s.rd_regfile(2, 0x30)) == devices[2].words[0x30]
+    assert s._jtag.round_trips == trips
+
+def test_ber_accumulation(sim):
+    s = sim('--sim-ber', '1e-7')
+    run(s.start_prbs_link)
+    ber = s._jtag.devices[0].link_ber()
+    # target the model BER, so the measurement runs the full time through several counter resets
+    result, out = run(s.ber_measure, target=ber, max_time=1.0)
+    assert result['verdict'] == 'INCONCLUSIVE'
+    assert result['errors'] > 2 * s.PRBS_ERR_CNT_RESET
+    assert result['ber'] == pytest.approx(ber, rel=0.1)
+
+def test_result_store(tmp_path):
+    path = str(tmp_path / 'store')
+    rf = st.SerdesTool.regfile
+    base = [0] * rf.size
+    for field in rf.fields.values():
+        base[field.addr] |= field.encode(field.val)
+    amp = rf.fields['TX_AMP']
+    with st.ResultStore(path, rf) as store:
+        for (value, errors) in ((10, 5), (10, 7), (20, 1)):
+            row = list(base)
+            row[amp.addr] = (row[amp.addr] & ~amp.mask) | amp.encode(value)
+            store.append(1, row, errors, 1e9, 1)
+        store.append(2, base, 100, 1e9, 1)
+    store = st.ResultStore(path, rf, readonly=True)
+    assert store.rows == 4
+    assert store.ber_by('TX_AMP', device=1) == {10: (12, 2e9), 20: (1, 1e9)}
+    assert store.ber_by('TX_AMP', device=2) == {amp.val: (100, 1e9)}
+    store.close()
+
+def test_result_store_prbs(sim, tmp_path):
+    s = sim('--sim-ber', '1e-7', '--store', str(tmp_path / 'store'))
+    run(s.start_prbs_link)
+    s._jtag.devices[0].set_field('TX_AMP', 15) # a field the PRBS run never touches
+    s.invalidate()
+    result, out = run(s.ber_measure, target=1e-12, max_time=0.2)
+    s.store.flush()
+    by_amp = s.store.ber_by('TX_AMP')
+    assert list(by_amp) == [15]
+    assert by_amp[15][0] == result['errors']
+
+def test_loopback(sim):
+    s = sim()
+    result, out = run(s.tc_loopback)
+    assert 'Checking 8-Bit comma alignment' in out
+    assert 'ERROR' not in out
+
+def test_cfg_skip(sim):
+    s = sim()
+    bitstream = bytes(range(256))
+    assert run(s.wr_cfg, bitstream)[0] is True
+    result, out = run(s.wr_cfg, bitstream)
+    assert result is False and 'skipping configuration' in out
+    assert run(s.wr_cfg, bitstream, force=True)[0] is True
+    assert run(s.wr_cfg, bitstream[::-1])[0] is True
+
+def test_cfg_database_parallel(tmp_path, monkeypatch):
+    monkeypatch.setattr(st.CfgDatabase, 'path', str(tmp_path / 'configured'))
+    def board(serial):
+        for n in range(50):
+            st.CfgDatabase().set(f'{serial}:0', f'{serial}-{n}')
+    threads = [threading.Thread(target=board, args=(f'FT{i:04d}',)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db = st.CfgDatabase()
+    assert [db.get(f'FT{i:04d}:0') for i in range(8)] == [f'FT{i:04d}-49' for i in range(8)]
+    assert not [name for name in os.listdir(tmp_path / 'configured') if name.endswith('.tmp')]
+
+def test_run_boards(tmp_path, monkeypatch):
+    # the workers are spawned and see nothing of this process but their arguments
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    args = st.ArgParser().parse_args(['-b', 'sim', '--serial', 'a,b', '--tcloopback'])
+    result, out = run(st.RunBoards, args, ['a', 'b'])
+    assert result == 0
+    assert 'Checking 8-Bit comma alignment' in out
+    assert sum(' PASS ' in line for line in out.splitlines()) == 2
+
+def test_loopback_align_timeout(sim, monkeypatch):
+    s = sim()
+    dev = s._jtag.devices[0]
+    update = dev.update
+    def never_aligned():
+        update()
+        dev.set_field('RX_BYTE_IS_ALIGNED', 0)
+    dev.update = never_aligned
+    wait_for = s.wait_for
+    monkeypatch.setattr(s, 'wait_for', lambda name, cond=lambda v: v == 1, timeout=5.0: wait_for(name, cond, min(timeout, 0.05)))
+    result, out = run(s.tc_loopback)
+    assert out.count('ERROR: RX_BYTE_IS_ALIGNED timeout') == 9 # three alignment tests per loopback mode
+
+def test_pll_table():
+    table = st.PllTable(100e6, st.SerdesTool.olclkg)
+    assert table._points is None # built on first use
+    assert table.pick(1250e6) == (1, 5, 5, 4, 1250e6)
+    assert all(main_divsel < 32 for (main_divsel, out_divsel) in table.points)
+    assert all(table.DCO_RANGE[0] <= p['dco'] <= table.DCO_RANGE[1] and p['bit_rate'] <= table.MAX_BIT_RATE for p in table.points.values())
+    assert table.lookup(0x20 | 0x1E, 3, 0, 1) == table.lookup(0x1E, 3, 0, 1) # PLL_MAIN_DIVSEL[5] is not used
+    with pytest.raises(ValueError, match='closest is'):
+        table.pick(1251e6)
+
+def test_pll_unreachable_rate(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    before = list(dev.words)
+    result, out = run(s.start_serdes_pll, rate=1251)
+    assert 'ERROR: 1251 Mbit/s is not reachable' in out
+    assert dev.words == before
+
+def test_record_polls_volatile_words(sim, tmp_path, monkeypatch):
+    s = sim()
+    dev = s._jtag.devices[0]
+    seen = []
+    def sink(t, words):
+        seen.append(words[0x1D] == dev.words[0x1D])
+        dev.words[0x1D] ^= 0x0001 # every sample must see the previous flip
+        if len(seen) == 10:
+            raise KeyboardInterrupt
+    monkeypatch.setattr(st.TelemetryRecorder, 'push', lambda self, t, words: sink(t, words))
+    run(s.record_telemetry, str(tmp_path / 'log'), interval=0.0)
+    assert seen == [True] * 10
+    assert (st.SerdesPoller.FAST_INTERVAL, st.SerdesPoller.DUTY) == (0.05, 0.5)
+
+def test_stats_round_trips(sim):
+    s = sim('--stats')
+    engine = s._jtag
+    assert not {'read_dr', 'write_dr', 'sync'} & set(vars(engine)) # nothing is patched
+    trips = engine.round_trips
+    usb = s.stats.totals['usb'][0]
+    s.invalidate()
+    s.rd_regfile(0, 0x31)
+    s.wr_regfile(0, 0x31, 0x0001, 0x0001)
+    s.rd_regfile_burst(0, range(0x38, 0x40))
+    with s.sequence():
+        s.rd_regfile_burst(0, range(0x30, 0x38), deferred=True)
+        s.wr_regfile(0, 0x30, 0x0123, 0xFFFF)
+    assert s.stats.totals['usb'][0] - usb == engine.round_trips - trips
+    assert {caller for (op, caller) in s.stats.callers} >= {'rd_regfile', 'wr_regfile', 'rd_regfile_burst'}
+    run(s.stats.print_summary)
+
+def test_stats_without_callers(sim):
+    s = sim()
+    stats = st.JtagStats(s._tool, 20e6, callers=False)
+    s.rd_regfile(0, 0x1D)
+    assert stats.totals['usb'][0] == 1 and stats.totals['dr'][0] == 2
+    assert not stats.callers
+
+def test_bench(sim):
+    s = sim()
+    bench = st.SerdesBench(s, 0, duration=0.05)
+    trips = s._jtag.round_trips
+    results, out = run(bench.run, ['rd_regfile', 'draw_parameters'])
+    result = results['rd_regfile']
+    assert result['usb_per_op'] * result['ops'] == s._jtag.round_trips - trips
+    assert result['usb_per_op'] >= 1
+    assert 'draw_parameters' not in results and 'needs a terminal' in out # pytest captures stdout
+    assert s._tool.stats is None
+
+def test_burst_reads(sim):
+    s = sim()
+    dev = s._jtag.devices[0]
+    addrs = list(range(0x50, 0x5D))
+    trips = s._jtag.round_trips
+    words = s._tool.rd_serdes_regfile_burst(0, addrs)
+    assert s._jtag.round_trips == trips + 1 # the whole range in one flush
+    assert [int(word) for word in words] == [dev.words[addr] for addr in addrs]
+
+def test_snapshot_diff():
+    rf = st.SerdesTool.regfile
+    words = [0] * rf.size
+    for field in rf.fields.values():
+        words[field.addr] |= field.encode(field.val)
+    old = st.SerdesSnapshot(rf, words)
+    assert all(old[name] == field.val for (name, field) in rf.fields.items())
+    amp = rf.fields['TX_AMP']
+    words[amp.addr] = (words[amp.addr] & ~amp.mask) | amp.encode(amp.val ^ 1)
+    new = st.SerdesSnapshot(rf, words).freeze()
+    assert new.diff(old) == [(amp, amp.val, amp.val ^ 1)]
+    assert new.diff(new) == []
+    assert len(new.diff(None)) == len(rf.fields)
+
+def test_cfg_sidecar(tmp_path, monkeypatch):
+    cfg = tmp_path / 'design.cfg'
+    cfg.write_text('// header\n0102 03\n04ff // trailer\n')
+    assert st.ReadCfgFile(str(cfg)) == bytes([1, 2, 3, 4, 0xFF])
+    (sidecar,) = tmp_path.glob('design.cfg.*.bin')
+    # an unchanged source is served from the sidecar without parsing it
+    monkeypatch.setattr(st, 'ParseCfgText', lambda filename: pytest.fail('parsed again'))
+    assert st.ReadCfgFile(str(cfg)) == bytes([1, 2, 3, 4, 0xFF])
+    monkeypatch.undo()
+    cfg.write_text('0a0b\n')
+    assert st.ReadCfgFile(str(cfg)) == bytes([0x0A, 0x0B])
+    assert not sidecar.exists() and len(list(tmp_path.glob('design.cfg.*.bin'))) == 1 # the stale sidecar is replaced
+    cfg.write_text('0a0\n')
+    with pytest.raises(ValueError, match='Odd number'):
+        st.ReadCfgFile(str(cfg))
+
+def test_ber_limits():
+    lower, upper = st.BerLimits(0, 1e9)
+    assert lower == 0.0 and upper == pytest.approx(-math.log(0.05) / 1e9, rel=1e-6)
+    lower, upper = st.BerLimits(10, 1e9)
+    # the bounds are where the Poisson tail reaches 1 - confidence
+    assert st.PoissonCdf(10, upper * 1e9) == pytest.approx(0.05, abs=1e-6)
+    assert 1 - st.PoissonCdf(9, lower * 1e9) == pytest.approx(0.05, abs=1e-6)
+    assert st.BerLimits(5, 0) == (0.0, 1.0)
+    # the normal approximation takes over smoothly
+    exact, approx = st.BerLimits(100, 1e9), st.BerLimits(101, 1e9)
+    assert approx[1] == pytest.approx(exact[1], rel=0.05)
+
+@pytest.mark.parametrize('sim_ber, verdict', [('1e-15', 'PASS'), ('1e-4', 'FAIL')])
+def test_ber_early_stop(sim, sim_ber, verdict):
+    s = sim('--sim-ber', sim_ber)
+    run(s.start_prbs_link)
+    result, out = run(s.ber_measure, target=1e-8, max_time=5.0)
+    assert result['verdict'] == verdict
+    assert result['time'] < 5.0